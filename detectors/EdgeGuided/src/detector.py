@@ -1,5 +1,6 @@
 from enum import Enum
 from pathlib import Path
+from typing import List, Sequence
 
 import math
 import numpy as np
@@ -14,11 +15,21 @@ from .implementation.evaluate import (
     BDCN,
     DenseNet2D,
     DeepVOG_pytorch,
+    EdgeSegmentationNetwork,
     preprocess_frame,
-    evaluate_ellseg_on_image,
+    inference_mode,
+    trace_network,
+    fit_ellipses,
     rescale_to_original,
     get_config,
 )
+from .metrics import stage
+
+# The maximal number of frames processed in a single forward pass
+BATCH_SIZE = 16
+
+# The size [H, W] the frames are scaled to
+INPUT_SHAPE = (240, 320)
 
 
 class DetectorType(str, Enum):
@@ -26,17 +37,47 @@ class DetectorType(str, Enum):
     DEEPVOG = "deepvog"
 
 
+class EllipseOptimiser(str, Enum):
+    SEARCH = "search"
+    GRADIENT = "gradient"
+
+
 class Config(BaseModel):
     neural_network: DetectorType = DetectorType.RIT_NET
+    ellipse_optimiser: EllipseOptimiser = EllipseOptimiser.SEARCH
+    torchscript: bool = False
+
+
+def _load_network(
+    neural_network: DetectorType, device: torch.device, torchscript: bool
+) -> torch.nn.Module:
+    state_dict = torch.load(
+        Path(__file__).parent / "implementation/gen_00000016.pt",
+        map_location=device,
+    )
+
+    bdcn = BDCN()
+    bdcn.load_state_dict(state_dict["a"])
 
+    if neural_network.value == DetectorType.RIT_NET.value:
+        setting = get_config(
+            Path(__file__).parent / "implementation/configs/baseline_edge.yaml"
+        )
+        model = DenseNet2D(setting)
+    else:
+        model = DeepVOG_pytorch()
 
-class _DetectionArguments:
-    """
-    Detection arguments required by the original information.
-    """
+    netDict = torch.load(
+        Path(__file__).parent / "implementation/baseline_edge_16.pkl",
+        map_location=device,
+    )
+    model.load_state_dict(netDict["state_dict"])
 
-    def __init__(self) -> None:
-        self.prec = torch.device("cpu")
+    # Ensure to place the networks on the suitable device
+    network = EdgeSegmentationNetwork(model, bdcn).to(device=device).eval()
+    if torchscript:
+        network = trace_network(network, INPUT_SHAPE, device)
+    return network
 
 
 class Detector(AbstractDetector):
@@ -48,52 +89,65 @@ class Detector(AbstractDetector):
             print("Using CPU for detection")
             self.device = torch.device("cpu")
 
-        state_dict = torch.load(
-            Path(__file__).parent / "implementation/gen_00000016.pt",
-            map_location=self.device,
+        # Instances with the same network share the loaded weights
+        self.network = self.shared_model(
+            (config.neural_network.value, self.device.type, config.torchscript),
+            lambda: _load_network(
+                config.neural_network, self.device, config.torchscript
+            ),
         )
+        self.ellipse_optimiser = config.ellipse_optimiser.value
 
-        self.bdcn = BDCN()
-        self.bdcn.load_state_dict(state_dict["a"])
+        # The frames tiled to RGB for BDCN. The buffer is reused by all detections.
+        self._frames_rgb = torch.empty((0, 3) + INPUT_SHAPE, device=self.device)
 
-        if config.neural_network.value == DetectorType.RIT_NET.value:
-            setting = get_config(
-                Path(__file__).parent / "implementation/configs/baseline_edge.yaml"
+    def detect(self, frame: np.ndarray) -> Ellipse:
+        frame_scaled_shifted, scale_shift = preprocess_frame(frame, INPUT_SHAPE, True)
+        output = self._evaluate([frame_scaled_shifted])[0]
+        return self._postprocess(output, scale_shift, frame.shape)
+
+    def detect_batch(self, frames: Sequence[np.ndarray]) -> List[Ellipse]:
+        predictions = []
+        for start in range(0, len(frames), BATCH_SIZE):
+            chunk = frames[start : start + BATCH_SIZE]
+            preprocessed = [preprocess_frame(frame, INPUT_SHAPE, True) for frame in chunk]
+
+            # Frames sharing the same size after preprocessing are evaluated in a single pass
+            tensors = [frame for frame, _ in preprocessed]
+            if len(set(tensor.shape for tensor in tensors)) == 1:
+                outputs = self._evaluate(tensors)
+            else:
+                outputs = [self._evaluate([tensor])[0] for tensor in tensors]
+
+            for frame, (_, scale_shift), output in zip(chunk, preprocessed, outputs):
+                predictions.append(self._postprocess(output, scale_shift, frame.shape))
+        return predictions
+
+    def _evaluate(self, tensors: Sequence[torch.Tensor]):
+        frames = torch.stack(tensors).to(self.device)
+        if (
+            self._frames_rgb.shape[0] < frames.shape[0]
+            or self._frames_rgb.shape[2:] != frames.shape[2:]
+        ):
+            self._frames_rgb = torch.empty(
+                (frames.shape[0], 3) + frames.shape[2:], device=self.device
             )
-            self.model = DenseNet2D(setting)
-        else:
-            self.model = DeepVOG_pytorch()
+        frames_rgb = self._frames_rgb[: frames.shape[0]]
 
-        netDict = torch.load(
-            Path(__file__).parent / "implementation/baseline_edge_16.pkl",
-            map_location=self.device,
-        )
-        self.model.load_state_dict(netDict["state_dict"])
+        with stage("forward"), inference_mode():
+            frames_rgb.copy_(frames.expand(-1, 3, -1, -1))
+            frames_edge, output, elPred = self.network(frames, frames_rgb)
 
-        # Ensure to place the networks on the suitable device
-        self.model = self.model.to(device=self.device)
-        self.bdcn = self.bdcn.to(device=self.device)
+        with stage("fit"):
+            return fit_ellipses(frames_edge, output, elPred, self.ellipse_optimiser)
 
-        # Strange, but well ...
-        self.args = _DetectionArguments()
-        self.args.prec = self.device
-
-    def detect(self, frame: np.ndarray) -> Ellipse:
-        frame_scaled_shifted, scale_shift = preprocess_frame(frame, (240, 320), True)
-        input_tensor = frame_scaled_shifted.to(self.device).unsqueeze(0)
-
-        # Run the prediction network
-        edge_map, seg_map, pupil_ellipse, iris_ellipse = evaluate_ellseg_on_image(
-            input_tensor,
-            self.model,
-            self.bdcn,
-            args=self.args,
-            device=self.device,
-        )
+    @staticmethod
+    def _postprocess(output, scale_shift, shape) -> Ellipse:
+        edge_map, seg_map, pupil_ellipse, iris_ellipse = output
         edge_map *= 255
         edge_map = 255 - edge_map
         _, _, pupil_ellipse, _ = rescale_to_original(
-            edge_map, seg_map, pupil_ellipse, iris_ellipse, scale_shift, frame.shape
+            edge_map, seg_map, pupil_ellipse, iris_ellipse, scale_shift, shape
         )
 
         return Ellipse(
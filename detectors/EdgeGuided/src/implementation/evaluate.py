@@ -8,6 +8,7 @@ Created on Fri Jan 29 03:34:22 2021
 
 import os, pickle
 import sys
+import logging
 import cv2
 import copy
 import torch
@@ -28,9 +29,12 @@ from .helperfunctions import (
     plot_segmap_ellpreds,
     my_ellipse,
 )
+from ..metrics import stage
 from .pytorchtools import load_from_file
 from .bdcn_new import BDCN
 
+logger = logging.getLogger(__name__)
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -148,52 +152,140 @@ def calc_edge(img, edge_model):
     return img_edge
 
 
+def inference_mode():
+    """
+    Disable the autograd, using "torch.inference_mode" if provided by torch.
+    """
+    return getattr(torch, "inference_mode", torch.no_grad)()
+
+
+class EdgeSegmentationNetwork(torch.nn.Module):
+    """
+    The edge detection by BDCN and the segmentation in a single pass. BDCN
+    expects RGB input, so the grayscale frames [B, 1, H, W] are given tiled
+    to [B, 3, H, W] as well.
+    """
+
+    def __init__(self, model, edge_model):
+        super(EdgeSegmentationNetwork, self).__init__()
+        self.model = model
+        self.edge_model = edge_model
+
+    def forward(self, frames, frames_rgb):
+        frames_edge = self.edge_model(frames_rgb)[-1]
+        B, _, H, W = frames.shape
+        labels = torch.zeros((B, H, W), device=frames.device)
+        labels[..., 0, 2] = 1
+        labels[..., 2, 2] = 2
+        output, elPred, _, _, _ = self.model(
+            frames,
+            frames_edge,
+            labels.long(),
+            torch.zeros((B, 2), device=frames.device, dtype=frames.dtype),
+            torch.zeros((B, 2, 5), device=frames.device, dtype=frames.dtype),
+            torch.zeros((B, H, W), device=frames.device, dtype=frames.dtype),
+            torch.zeros((B, 3, H, W), device=frames.device, dtype=frames.dtype),
+            torch.zeros((B, 4), device=frames.device, dtype=frames.dtype),
+            0,
+            0,
+        )
+        return frames_edge, output, elPred
+
+
+def trace_network(network, shape, device):
+    """
+    Compile the network by TorchScript for frames of the given shape [H, W]
+    and freeze it if supported by torch. If the traced network does not match
+    the network on a batch of another size, the network is returned as is.
+    """
+
+    def example(batch_size):
+        frames = torch.randn((batch_size, 1) + tuple(shape), device=device)
+        return frames, frames.expand(-1, 3, -1, -1).contiguous()
+
+    with torch.no_grad():
+        try:
+            traced = torch.jit.trace(network, example(1))
+            if hasattr(torch.jit, "freeze"):
+                traced = torch.jit.freeze(traced)
+
+            frames = example(2)
+            if all(
+                torch.allclose(expected, actual, rtol=1e-3, atol=1e-4)
+                for expected, actual in zip(network(*frames), traced(*frames))
+            ):
+                return traced
+            logger.warning("The traced network differs. Using the network as is")
+        except Exception:
+            logger.warning("Unable to trace the network", exc_info=True)
+    return network
+
+
 #%% Forward operation on network
 def evaluate_ellseg_on_image(
     frame, model, edge_model, args, device=torch.device("cuda")
 ):
 
     assert len(frame.shape) == 4, "Frame must be [1,1,H,W]"
-    frame_edge = calc_edge(frame, edge_model)
-    _, _, H, W = frame.shape
-    with torch.no_grad():
-        labels = torch.zeros((1, H, W))
-        labels[..., 0, 2] = 1
-        labels[..., 2, 2] = 2
-        op_tup = model(
-            frame.to(device).to(args.prec),
-            frame_edge.to(device).to(args.prec),
-            labels.to(device).long(),
-            torch.zeros((1, 2)).to(device).to(args.prec),
-            torch.zeros((1, 2, 5)).to(device).to(args.prec),
-            torch.zeros((1, H, W)).to(device).to(args.prec),
-            torch.zeros((1, 3, H, W)).to(device).to(args.prec),
-            torch.zeros((1, 4)).to(device).to(args.prec),
-            0,
-            0,
+    return evaluate_ellseg_on_batch(frame, model, edge_model, args, device)[0]
+
+
+def evaluate_ellseg_on_batch(
+    frames, model, edge_model, args, device=torch.device("cuda")
+):
+
+    assert len(frames.shape) == 4, "Frames must be [B,1,H,W]"
+    network = EdgeSegmentationNetwork(model, edge_model)
+    frames = frames.to(device).to(args.prec)
+    with stage("forward"), inference_mode():
+        frames_edge, output, elPred = network(frames, frames.expand(-1, 3, -1, -1))
+
+    with stage("fit"):
+        return fit_ellipses(
+            frames_edge,
+            output,
+            elPred,
+            getattr(args, "ellipse_optimiser", "search"),
         )
-        output, elPred, _, _, elll = op_tup
-        seg_out, elPred = output.cpu(), elPred.squeeze().cpu()
 
-        # seg_map = get_predictions(seg_out).squeeze().numpy()
-        seg_map = get_predictions(seg_out).squeeze()
-        # print(seg_map.shape)
 
-        norm_pupil_ellipse = elPred[5:10]
-        norm_iris_ellipse = elPred[0:5]
+def fit_ellipses(frames_edge, output, elPred, optimiser="search"):
+    """
+    Refine the ellipses regressed by the network on its segmentation maps.
+    Returns the edge map, the segmentation map, and the pupil and iris
+    ellipses of each frame.
+    """
+    seg_out, elPred = output.cpu(), elPred.cpu()
+    seg_maps = get_predictions(seg_out)
+    B, _, H, W = seg_out.shape
+
+    # Transformation function H
+    transform = np.array([[W / 2, 0, W / 2], [0, H / 2, H / 2], [0, 0, 1]])
 
-        # Transformation function H
-        _, _, H, W = frame.shape
-        H = np.array([[W / 2, 0, W / 2], [0, H / 2, H / 2], [0, 0, 1]])
+    # The ellipse refinement is evaluated on each sample independently
+    results = []
+    for i in range(B):
+        seg_map = seg_maps[i]
+        norm_pupil_ellipse = elPred[i, 5:10]
+        norm_iris_ellipse = elPred[i, 0:5]
 
-        pupil_ellipse = my_ellipse(norm_pupil_ellipse.numpy()).transform(H)[0][:-1]
-        iris_ellipse = my_ellipse(norm_iris_ellipse.numpy()).transform(H)[0][:-1]
+        pupil_ellipse = my_ellipse(norm_pupil_ellipse.numpy()).transform(transform)[0][:-1]
+        iris_ellipse = my_ellipse(norm_iris_ellipse.numpy()).transform(transform)[0][:-1]
 
         iris_ellipse = search_proper_parameter_iou_for_our_data(
-            (seg_map == 1).cpu(), iris_ellipse
+            (seg_map == 1).cpu(), iris_ellipse, optimiser
         )
         pupil_ellipse = search_proper_parameter_iou_for_our_data(
-            (seg_map == 2).cpu(), pupil_ellipse
+            (seg_map == 2).cpu(), pupil_ellipse, optimiser
+        )
+
+        results.append(
+            (
+                frames_edge[i].detach().cpu().squeeze().numpy(),
+                seg_map.numpy(),
+                pupil_ellipse,
+                iris_ellipse,
+            )
         )
 
     # print(frame.shape, seg_map.shape, elPred.shape)
@@ -208,12 +300,7 @@ def evaluate_ellseg_on_image(
     #                           override=True,
     #                           heatmaps=False)
 
-    return (
-        frame_edge.detach().cpu().squeeze().numpy(),
-        seg_map.numpy(),
-        pupil_ellipse,
-        iris_ellipse,
-    )
+    return results
 
 
 #%% Rescale operation to bring segmap, pupil and iris ellipses back to original res
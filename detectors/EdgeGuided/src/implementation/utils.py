@@ -12,6 +12,7 @@ import os
 import cv2
 import tqdm
 import copy
+import functools
 import torch, time
 import numpy as np
 import torch.nn as nn
@@ -435,6 +436,161 @@ def generateImageGrid(
     return I_o
 
 
+@functools.lru_cache(maxsize=8)
+def _pixel_grid(height, width):
+    """
+    The pixel coordinates of the normalized meshgrid used by calc_ell_iou. The
+    meshgrid spans [-1, 1] over the image while the ellipses are normalized by
+    the image size, so the columns are stretched by width / (width - 1).
+    """
+    xs = np.arange(width) * (width / max(width - 1, 1))
+    ys = np.arange(height) * (height / max(height - 1, 1))
+    xs.setflags(write=False)
+    ys.setflags(write=False)
+    return xs, ys
+
+
+def _ellipse_roi(params, xs, ys, margin=0.0):
+    # The slices of the grid covering the bounding boxes of all the ellipses
+    _, _, a, b, theta = params.T
+    cos, sin = np.cos(theta), np.sin(theta)
+    half_width = np.sqrt((a * cos) ** 2 + (b * sin) ** 2) + margin
+    half_height = np.sqrt((a * sin) ** 2 + (b * cos) ** 2) + margin
+    columns = slice(
+        np.searchsorted(xs, np.min(params[:, 0] - half_width), side="left"),
+        np.searchsorted(xs, np.max(params[:, 0] + half_width), side="right"),
+    )
+    rows = slice(
+        np.searchsorted(ys, np.min(params[:, 1] - half_height), side="left"),
+        np.searchsorted(ys, np.max(params[:, 1] + half_height), side="right"),
+    )
+    return rows, columns
+
+
+def _ellipse_distance(params, xs, ys, rows, columns):
+    # The implicit function of the ellipses [N, 5] within the ROI: X, Y, and wtMat of calc_ell_iou
+    cx, cy, a, b, theta = (value[:, None, None] for value in params.T)
+    dx = xs[columns][None, None, :] - cx
+    dy = ys[rows][None, :, None] - cy
+    X = dx * np.cos(theta) + dy * np.sin(theta)
+    Y = -dx * np.sin(theta) + dy * np.cos(theta)
+    return X, Y, (X / a) ** 2 + (Y / b) ** 2 - 1
+
+
+def ellipse_iou_batch(seg, params, seg_area=None):
+    """
+    The IoU of a binary map [H, W] with each of the filled ellipses [N, 5]
+    given as (cx, cy, a, b, theta) in pixels and radians. Equals calc_ell_iou
+    for nor=False but only rasterises the bounding box of the ellipses.
+    """
+    params = np.atleast_2d(np.asarray(params, dtype=np.float64))
+    seg = np.asarray(seg, dtype=bool)
+    if seg_area is None:
+        seg_area = np.count_nonzero(seg)
+
+    xs, ys = _pixel_grid(*seg.shape)
+    rows, columns = _ellipse_roi(params, xs, ys)
+    inside = _ellipse_distance(params, xs, ys, rows, columns)[2] <= 0
+    intersection = np.count_nonzero(inside & seg[rows, columns], axis=(1, 2))
+    union = seg_area + np.count_nonzero(inside, axis=(1, 2)) - intersection
+
+    # Like the torch implementation, the scores are compared in single precision
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return intersection.astype(np.float32) / union.astype(np.float32)
+
+
+def _search_ellipse_parameters(score, center, ans, iterations=40):
+    """
+    Coordinate search over the axes and the angle (in degree) of an ellipse as
+    in search_proper_parameter_iou. Both perturbations of a coordinate are
+    scored at once by score(params [2, 5]).
+    """
+
+    def to_params(candidates):
+        params = np.array([center + candidate for candidate in candidates])
+        params[:, 4] = params[:, 4] / 180.0 * 3.14159
+        return params
+
+    rt = score(to_params([ans]))[0]
+    now = ans.copy()
+    d = [1.0, 1.0, 1.0]
+    for tt in range(iterations):
+        flag = False
+        for j in range(3):
+            lower, upper = now.copy(), now.copy()
+            lower[j] -= d[j]
+            upper[j] = lower[j] + 2.0 * d[j]
+            scores = score(to_params([lower, upper]))
+            if scores[0] > rt:
+                flag, now, now_score = True, lower, scores[0]
+                continue
+            if scores[1] > rt:
+                flag, now, now_score = True, upper, scores[1]
+                continue
+            now[j] = upper[j] - d[j]
+            d[j] *= 0.8  # decrease learning_rate
+        if not flag:
+            break
+        rt = now_score
+    return now
+
+
+def _ascend_ellipse_iou(seg, seg_area, params, iterations=40):
+    """
+    Gradient ascent of the IoU over the axes and the angle (in radians) of an
+    ellipse. The gradient of a soft rasterisation gives the direction, while
+    the step length is chosen by the exact IoU of a few candidates.
+    """
+    xs, ys = _pixel_grid(*seg.shape)
+    steps = np.array([4.0, 2.0, 1.0, 0.5, 0.25])
+    best = np.array(params, dtype=np.float64)
+    if seg_area == 0:
+        return best
+    rt = ellipse_iou_batch(seg, best, seg_area)[0]
+    for tt in range(iterations):
+        cx, cy, a, b, theta = best
+        rows, columns = _ellipse_roi(best[None], xs, ys, margin=3.0)
+        distance = _ellipse_distance(best[None], xs, ys, rows, columns)
+        X, Y, wtMat = (value[0] for value in distance)
+
+        # A transition of about a pixel at the boundary
+        sharpness = max(min(abs(a), abs(b)), 1.0) / 2.0
+        soft = 1.0 / (1.0 + np.exp(np.clip(sharpness * wtMat, -50.0, 50.0)))
+        target = seg[rows, columns]
+        intersection = np.sum(soft[target])
+        union = seg_area + np.sum(soft) - intersection
+        if union <= 0:
+            break
+        d_soft = np.where(target, union, -intersection) / union**2
+        d_wtMat = -sharpness * soft * (1.0 - soft) * d_soft
+        gradient = np.array(
+            [
+                np.sum(d_wtMat * -2.0 * X**2 / a**3),
+                np.sum(d_wtMat * -2.0 * Y**2 / b**3),
+                np.sum(d_wtMat * 2.0 * X * Y * (1.0 / a**2 - 1.0 / b**2)),
+            ]
+        )
+
+        # Steps move the boundary by about the given number of pixels
+        radius = max(abs(a), abs(b), 1.0)
+        direction = gradient / np.array([1.0, 1.0, radius])
+        norm = np.linalg.norm(direction)
+        if not np.isfinite(norm) or norm == 0:
+            break
+        direction /= norm * np.array([1.0, 1.0, radius])
+
+        candidates = np.repeat(best[None], len(steps), axis=0)
+        candidates[:, 2:] += steps[:, None] * direction[None]
+        scores = ellipse_iou_batch(seg, candidates, seg_area)
+        if np.nanmax(scores) > rt:
+            best, rt = candidates[np.nanargmax(scores)], np.nanmax(scores)
+        elif steps[-1] > 0.05:
+            steps = steps / 4.0
+        else:
+            break
+    return best
+
+
 def search_proper_parameter_iou(seg, elNorm, elNorm_gt, ell_para, ell_para_gt):
     H, W = seg.shape
     mesh = create_meshgrid(H, W, normalized_coordinates=True)  # 1xHxWx2
@@ -443,39 +599,18 @@ def search_proper_parameter_iou(seg, elNorm, elNorm_gt, ell_para, ell_para_gt):
     p_score = calc_ell_iou(seg, elNorm, mesh)
     center = [ell_para[0], ell_para[1]]
     ans = [ell_para[2], ell_para[3], ell_para[4] * 180.0 / 3.14159]
-    rt = calc_ell_iou(seg, np.array(center + ans), mesh, False, True)
     # print('pupil   : ', pri(ell_para))
     # print('pupil gt: ', pri(ell_para_gt))
-    # print(rt, ans, gtp_score)
     # print('!!!!!!!----------start--search-------')
-    now = ans.copy()
-    d = [1.0, 1.0, 1.0]
-    for tt in range(40):
-        flag = False
-        for j in range(3):
-            now[j] -= d[j]
-            score = calc_ell_iou(seg, np.array(center + now), mesh, False, True)
-            if score > rt:
-                flag = True
-                continue
-            now[j] += 2.0 * d[j]
-            score = calc_ell_iou(seg, np.array(center + now), mesh, False, True)
-            if score > rt:
-                flag = True
-                continue
-            now[j] -= d[j]
-            d[j] *= 0.8  # decrease learning_rate
-        score = calc_ell_iou(seg, np.array(center + now), mesh, False, True)
-        if score > rt:
-            # print(tt, 'score ', rt, '----> ', score, now)
-            rt = score
-        if not flag:
-            break
+    seg_map = np.asarray(seg, dtype=bool)
+    seg_area = np.count_nonzero(seg_map)
+    now = _search_ellipse_parameters(
+        lambda params: ellipse_iou_batch(seg_map, params, seg_area), center, ans
+    )
 
     # normal inverse
     # print('search successfully.....')
     # print(p_score, gtp_score)
-    # print(rt)
     # print(ans)
     # l_pupil_before = np.array(center + ans)
     l_pupil_after = np.array(center + now)
@@ -487,37 +622,25 @@ def search_proper_parameter_iou(seg, elNorm, elNorm_gt, ell_para, ell_para_gt):
     return after_bbiou, l_pupil_after
 
 
-def search_proper_parameter_iou_for_our_data(seg, ell_para):
-    H, W = seg.shape
-    mesh = create_meshgrid(H, W, normalized_coordinates=True)  # 1xHxWx2
-
+def search_proper_parameter_iou_for_our_data(seg, ell_para, optimiser="search"):
+    """
+    Refine the axes and the angle of an ellipse [cx, cy, a, b, theta] in pixels
+    to match the binary map seg [H, W]. The optimiser is either "search", the
+    original coordinate search, or "gradient", a gradient ascent of the IoU.
+    """
+    seg_map = np.asarray(seg, dtype=bool)
+    seg_area = np.count_nonzero(seg_map)
     center = [ell_para[0], ell_para[1]]
-    ans = [ell_para[2], ell_para[3], ell_para[4] * 180.0 / 3.14159]
-    rt = calc_ell_iou(seg, np.array(center + ans), mesh, False, True)
 
-    now = ans.copy()
-    d = [1.0, 1.0, 1.0]
-    for tt in range(40):
-        flag = False
-        for j in range(3):
-            now[j] -= d[j]
-            score = calc_ell_iou(seg, np.array(center + now), mesh, False, True)
-            if score > rt:
-                flag = True
-                continue
-            now[j] += 2.0 * d[j]
-            score = calc_ell_iou(seg, np.array(center + now), mesh, False, True)
-            if score > rt:
-                flag = True
-                continue
-            now[j] -= d[j]
-            d[j] *= 0.8  # decrease learning_rate
-        score = calc_ell_iou(seg, np.array(center + now), mesh, False, True)
-        if score > rt:
-            # print(tt, 'score ', rt, '----> ', score, now)
-            rt = score
-        if not flag:
-            break
+    if optimiser == "gradient":
+        return _ascend_ellipse_iou(seg_map, seg_area, np.array(ell_para[:5]))
+    if optimiser != "search":
+        raise ValueError("Unknown optimiser '{}'".format(optimiser))
+
+    ans = [ell_para[2], ell_para[3], ell_para[4] * 180.0 / 3.14159]
+    now = _search_ellipse_parameters(
+        lambda params: ellipse_iou_batch(seg_map, params, seg_area), center, ans
+    )
 
     l_pupil_after = np.array(center + now)
     l_pupil_after[4] = l_pupil_after[4] / 180.0 * 3.14159
@@ -1,4 +1,5 @@
 import importlib.resources as pkg_resources
+from typing import List, Sequence
 
 import math
 import torch
@@ -11,11 +12,15 @@ from .models.ellipse import Ellipse
 from .implementation.evaluate_ellseg import (
     preprocess_frame,
     evaluate_ellseg_on_image,
+    evaluate_ellseg_on_batch,
     rescale_to_original,
 )
 from .implementation.modelSummary import model_dict
 from .implementation import weights
 
+# The maximal number of frames processed in a single forward pass
+BATCH_SIZE = 16
+
 
 class Config(BaseModel):
     """An empty base model used for config."""
@@ -28,25 +33,26 @@ class _Args:
         self.ellseg_ellipses = 1
 
 
+def _load_model():
+    netDict = torch.load(
+        pkg_resources.open_binary(weights, "all.git_ok"),
+        map_location=torch.device("cpu"),
+    )
+    model = model_dict["ritnet_v3"]
+    model.load_state_dict(netDict["state_dict"], strict=True)
+    return model
+
+
 class Detector(AbstractDetector):
     def __init__(self, _: Config = Config()):
-        netDict = torch.load(
-            pkg_resources.open_binary(weights, "all.git_ok"),
-            map_location=torch.device("cpu"),
-        )
-        self.model = model_dict["ritnet_v3"]
-        self.model.load_state_dict(netDict["state_dict"], strict=True)
+        # The weights are loaded only once for all instances
+        self.model = self.shared_model("ritnet_v3", _load_model)
 
         # This is used inside the "evaluate_ellseg_on_image" function
         self.args = _Args()
 
     def detect(self, frame: np.ndarray) -> Ellipse:
-        try:
-            frame_scaled_shifted, scale_shift = preprocess_frame(
-                frame, (240, 320), True
-            )
-        except Exception as ex:
-            raise ValueError(f"Error during preprocessing: {ex}")
+        frame_scaled_shifted, scale_shift = self._preprocess(frame)
         input_tensor = frame_scaled_shifted.unsqueeze(0)
 
         # Run the prediction network.
@@ -54,10 +60,52 @@ class Detector(AbstractDetector):
         seg_map, _, pupil_ellipse, iris_ellipse = evaluate_ellseg_on_image(
             input_tensor, self.model, self.args
         )
+        return self._postprocess(
+            seg_map, pupil_ellipse, iris_ellipse, scale_shift, frame.shape
+        )
 
+    def detect_batch(self, frames: Sequence[np.ndarray]) -> List[Ellipse]:
+        predictions = []
+        for start in range(0, len(frames), BATCH_SIZE):
+            chunk = frames[start : start + BATCH_SIZE]
+            preprocessed = [self._preprocess(frame) for frame in chunk]
+
+            # Frames sharing the same size after preprocessing are evaluated in a single pass
+            tensors = [frame for frame, _ in preprocessed]
+            if len(set(tensor.shape for tensor in tensors)) == 1:
+                outputs = evaluate_ellseg_on_batch(
+                    torch.stack(tensors), self.model, self.args
+                )
+            else:
+                outputs = [
+                    evaluate_ellseg_on_image(tensor.unsqueeze(0), self.model, self.args)
+                    for tensor in tensors
+                ]
+
+            for frame, (_, scale_shift), (seg_map, _, pupil_ellipse, iris_ellipse) in zip(
+                chunk, preprocessed, outputs
+            ):
+                predictions.append(
+                    self._postprocess(
+                        seg_map, pupil_ellipse, iris_ellipse, scale_shift, frame.shape
+                    )
+                )
+        return predictions
+
+    @staticmethod
+    def _preprocess(frame: np.ndarray):
+        try:
+            return preprocess_frame(frame, (240, 320), True)
+        except Exception as ex:
+            raise ValueError(f"Error during preprocessing: {ex}")
+
+    @staticmethod
+    def _postprocess(
+        seg_map, pupil_ellipse, iris_ellipse, scale_shift, shape
+    ) -> Ellipse:
         # Return ellipse predictions back to original dimensions
         seg_map, pupil_ellipse, iris_ellipse = rescale_to_original(
-            seg_map, pupil_ellipse, iris_ellipse, scale_shift, frame.shape
+            seg_map, pupil_ellipse, iris_ellipse, scale_shift, shape
         )
 
         return Ellipse(
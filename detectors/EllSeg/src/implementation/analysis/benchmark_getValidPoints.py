@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare getValidPoints against its reference implementation on synthetic
+segmentation maps. Both must return identical point sets.
+"""
+
+import sys
+
+sys.path.append('..')
+
+import timeit
+import cv2
+import numpy as np
+from helperfunctions import getValidPoints, getValidPoints_loop
+
+def synthetic_segmap(height, width, rng):
+    '''
+    A segmentation map with sclera (1), iris (2) and pupil (3) on background (0).
+    The eye may be cut by the image border.
+    '''
+    LabelMat = np.zeros((height, width), dtype=np.uint8)
+    center = (int(rng.uniform(0, width)), int(rng.uniform(0, height)))
+    angle = rng.uniform(0, 180)
+    scale = min(height, width)
+    cv2.ellipse(LabelMat, center, (int(0.6*scale), int(0.3*scale)), angle, 0, 360, 1, -1)
+    cv2.ellipse(LabelMat, center, (int(0.25*scale), int(0.22*scale)), angle, 0, 360, 2, -1)
+    cv2.ellipse(LabelMat, center, (int(0.1*scale), int(0.08*scale)), angle, 0, 360, 3, -1)
+
+    # Speckles as produced by imperfect segmentations
+    speckles = rng.random((height, width)) < 0.002
+    LabelMat[speckles] = rng.integers(0, 4, np.sum(speckles))
+    return LabelMat
+
+def same_points(a, b):
+    if isinstance(a, list) or isinstance(b, list):
+        return isinstance(a, list) and isinstance(b, list)
+    return a.shape == b.shape and np.array_equal(a, b)
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    for height, width in [(240, 320), (480, 640)]:
+        maps = [synthetic_segmap(height, width, rng) for _ in range(20)]
+        for isPartSeg in [True, False]:
+            for LabelMat in maps:
+                expected = getValidPoints_loop(LabelMat, isPartSeg)
+                actual = getValidPoints(LabelMat, isPartSeg)
+                assert same_points(expected[0], actual[0]), 'Pupil points differ'
+                assert same_points(expected[1], actual[1]), 'Iris points differ'
+
+            loop = timeit.timeit(lambda: [getValidPoints_loop(m, isPartSeg) for m in maps], number=3)
+            fast = timeit.timeit(lambda: [getValidPoints(m, isPartSeg) for m in maps], number=3)
+            n = 3*len(maps)
+            print('{}x{} (isPartSeg={}): loop {:.2f} ms, vectorised {:.2f} ms, speedup {:.1f}x'.format(
+                width, height, isPartSeg, 1000*loop/n, 1000*fast/n, loop/fast))
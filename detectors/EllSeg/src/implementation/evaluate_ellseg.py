@@ -20,6 +20,7 @@ from tqdm import tqdm
 from pathlib import Path
 from pprint import pprint
 
+from ..metrics import stage
 from .utils import get_predictions
 from .modelSummary import model_dict
 from .helperfunctions import plot_segmap_ellpreds, getValidPoints
@@ -142,19 +143,31 @@ def preprocess_frame(img, op_shape, align_width=True):
 # %% Forward operation on network
 def evaluate_ellseg_on_image(frame, model, args):
     assert len(frame.shape) == 4, "Frame must be [1,1,H,W]"
+    return evaluate_ellseg_on_batch(frame, model, args)[0]
 
-    with torch.no_grad():
-        x4, x3, x2, x1, x = model.enc(frame)
+
+def evaluate_ellseg_on_batch(frames, model, args):
+    assert len(frames.shape) == 4, "Frames must be [B,1,H,W]"
+
+    with stage("forward"), torch.no_grad():
+        x4, x3, x2, x1, x = model.enc(frames)
         latent = torch.mean(x.flatten(start_dim=2), -1)
         elOut = model.elReg(x, 0)
         seg_out = model.dec(x4, x3, x2, x1, x)
 
-    seg_out, elOut, latent = (
-        seg_out.cpu(),
-        elOut.squeeze().cpu(),
-        latent.squeeze().cpu(),
-    )
+    seg_out, elOut, latent = seg_out.cpu(), elOut.cpu(), latent.cpu()
+
+    # The ellipse fitting is evaluated on each sample independently
+    with stage("fit"):
+        return [
+            postprocess_ellseg_output(
+                seg_out[i : i + 1], elOut[i], latent[i], frames.shape, args
+            )
+            for i in range(frames.shape[0])
+        ]
+
 
+def postprocess_ellseg_output(seg_out, elOut, latent, frame_shape, args):
     seg_map = get_predictions(seg_out).squeeze().numpy()
 
     ellipse_from_network = 1 if args.ellseg_ellipses == 1 else 0
@@ -185,7 +198,7 @@ def evaluate_ellseg_on_image(frame, model, args):
         norm_iris_ellipse = torch.cat([norm_iris_center, elOut[2:5]])
 
         # Transformation function H
-        _, _, H, W = frame.shape
+        _, _, H, W = frame_shape
         H = np.array([[W / 2, 0, W / 2], [0, H / 2, H / 2], [0, 0, 1]])
 
         pupil_ellipse = my_ellipse(norm_pupil_ellipse.numpy()).transform(H)[0][:-1]
@@ -287,28 +287,143 @@ class ransac():
         self.bestModel = self.model(**{'data': data}) #Fit function all data points
 
     def loop(self):
-        i = 0
-        if self.num_pts > self.n_min:
-            while i <= self.K:
-                # Pick n_min points at random from dataset
-                inlr = np.random.choice(self.num_pts, self.n_min, replace=False)
-                loc_inlr = np.in1d(np.arange(0, self.num_pts), inlr)
-                outlr = np.where(~loc_inlr)[0]
-                potModel = self.model(**{'data': self.data[loc_inlr, :]})
-                listErr = potModel.fit_error(self.data[~loc_inlr, :])
-                inlr_num = np.size(inlr) + np.sum(listErr < self.T)
-                if inlr_num > self.D:
-                    pot_inlr = np.concatenate([inlr, outlr[listErr < self.T]], axis=0)
-                    loc_pot_inlr = np.in1d(np.arange(0, self.num_pts), pot_inlr)
-                    betterModel = self.model(**{'data': self.data[loc_pot_inlr, :]})
-                    if betterModel.error < self.bestModel.error:
-                        self.bestModel = betterModel
-                i += 1
-        else:
+        if self.num_pts <= self.n_min:
             # If the num_pts <= n_min, directly return the model
             self.bestModel = self.model(**{'data': self.data})
+        elif self.model is ElliFit:
+            self.loop_vectorised()
+        else:
+            self.loop_sequential()
         return self.bestModel
 
+    def loop_sequential(self):
+        i = 0
+        while i <= self.K:
+            # Pick n_min points at random from dataset
+            inlr = np.random.choice(self.num_pts, self.n_min, replace=False)
+            loc_inlr = np.in1d(np.arange(0, self.num_pts), inlr)
+            outlr = np.where(~loc_inlr)[0]
+            potModel = self.model(**{'data': self.data[loc_inlr, :]})
+            listErr = potModel.fit_error(self.data[~loc_inlr, :])
+            inlr_num = np.size(inlr) + np.sum(listErr < self.T)
+            if inlr_num > self.D:
+                pot_inlr = np.concatenate([inlr, outlr[listErr < self.T]], axis=0)
+                loc_pot_inlr = np.in1d(np.arange(0, self.num_pts), pot_inlr)
+                betterModel = self.model(**{'data': self.data[loc_pot_inlr, :]})
+                if betterModel.error < self.bestModel.error:
+                    self.bestModel = betterModel
+            i += 1
+        return self.bestModel
+
+    def loop_vectorised(self):
+        '''
+        Evaluate all the hypotheses at once. Equivalent to loop_sequential
+        for ElliFit, but the random samples are drawn differently.
+        '''
+        data = self.data.astype(np.float64)
+        pts_lim = ElliFit().pts_lim
+
+        # Pick n_min points at random for each of the K+1 hypotheses
+        samples = np.argpartition(
+            np.random.rand(self.K + 1, self.num_pts), self.n_min - 1, axis=1
+            )[:, :self.n_min]
+        loc_samples = np.zeros((self.K + 1, self.num_pts), dtype=bool)
+        np.put_along_axis(loc_samples, samples, True, axis=1)
+
+        models = ellifit_batch(data[samples])
+        if 2*self.n_min <= pts_lim:
+            models[:] = -1
+
+        # The sampled points are always counted as inliers
+        loc_inlr = loc_samples | (ellifit_error_batch(models, data) < self.T)
+        inlr_num = np.sum(loc_inlr, axis=1)
+        candidates = np.where((inlr_num > self.D) & (2*inlr_num > pts_lim))[0]
+        if np.size(candidates) == 0:
+            return self.bestModel
+
+        # Refit on the inliers of all promising hypotheses together
+        loc_inlr = loc_inlr[candidates]
+        better_models = ellifit_batch(
+            np.broadcast_to(data, (np.size(candidates), ) + data.shape), loc_inlr
+            )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            errors = np.sum(
+                np.where(loc_inlr, ellifit_error_batch(better_models, data), 0),
+                axis=1
+                )/np.sum(loc_inlr, axis=1)
+        errors[np.isnan(errors)] = np.inf
+
+        best = np.argmin(errors)
+        if errors[best] < self.bestModel.error:
+            self.bestModel = self.model(**{'data': data[loc_inlr[best], :]})
+        return self.bestModel
+
+def ellifit_batch(data, mask=None):
+    '''
+    Fit ellipses with ElliFit to multiple sets of data points at once.
+
+    Parameters
+    ----------
+    data : np.array [B, N, 2]
+    mask : np.array [B, N], bool
+        The points each of the B fits is based on, all if not given.
+
+    Returns
+    -------
+    models : np.array [B, 5]
+        Ellipse parameters [cx, cy, a, b, theta], -1 if the fit failed.
+    '''
+    weights = np.ones(data.shape[:2]) if mask is None else mask.astype(np.float64)
+    num = np.sum(weights, axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xm = np.sum(weights*data[..., 0], axis=1, keepdims=True)/num
+        ym = np.sum(weights*data[..., 1], axis=1, keepdims=True)/num
+    x = data[..., 0] - xm
+    y = data[..., 1] - ym
+
+    # Masked points do not contribute to the normal equations
+    X = np.stack([x**2, 2*x*y, -2*x, -2*y, -np.ones_like(x)], axis=2)
+    Xw = X*weights[..., None]
+    XtX = np.einsum('bni,bnj->bij', Xw, X)
+    XtY = np.einsum('bni,bn->bi', Xw, -y**2)
+
+    Phi = -1*np.ones((data.shape[0], 5))
+    try:
+        Phi = np.linalg.solve(XtX, XtY[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # Solve one after another to isolate the singular systems
+        for i in range(data.shape[0]):
+            try:
+                Phi[i] = np.linalg.solve(XtX[i], XtY[i])
+            except np.linalg.LinAlgError:
+                pass
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        x0=(Phi[:, 2]-Phi[:, 3]*Phi[:, 1])/((Phi[:, 0])-(Phi[:, 1])**2)
+        y0=(Phi[:, 0]*Phi[:, 3]-Phi[:, 2]*Phi[:, 1])/((Phi[:, 0])-(Phi[:, 1])**2)
+        term2=np.sqrt(((1-Phi[:, 0])**2+4*(Phi[:, 1])**2))
+        term3=(Phi[:, 4] + (y0)**2 + (x0**2)*Phi[:, 0] + 2*Phi[:, 1])
+        term1=1+Phi[:, 0]
+        b=(np.sqrt(2*term3/(term1+term2)))
+        a=(np.sqrt(2*term3/(term1-term2)))
+        alpha=0.5*np.arctan2(2*Phi[:, 1],1-Phi[:, 0])
+        models = np.stack([x0+xm[:, 0], y0+ym[:, 0], a, b, -alpha], axis=1)
+    models[~np.all(np.isfinite(models), axis=1)] = -1
+    return models
+
+def ellifit_error_batch(models, data):
+    '''
+    The residuals of all data points [N, 2] for multiple ellipses [B, 5]
+    as returned by ElliFit.fit_error. Returns an array [B, N].
+    '''
+    cx, cy, a, b, theta = [models[:, i:i+1] for i in range(5)]
+    dx = data[None, :, 0] - cx
+    dy = data[None, :, 1] - cy
+    c, s = np.cos(theta), np.sin(theta)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        res = (1/a**2)*(dx*c - dy*s)**2 + (1/b**2)*(dx*s + dy*c)**2 - 1
+    return np.abs(res)
+
 # Helper functions
 def rotation_2d(theta):
     # Return a 2D rotation matrix in the anticlockwise direction
@@ -447,6 +562,36 @@ def getValidPoints(LabelMat, isPartSeg=True):
     Given labels, identify pupil and iris points.
     pupil: label == 3, iris: label ==2
     '''
+    if min(LabelMat.shape) <= 2:
+        # Python's negative indices would wrap around the image
+        return getValidPoints_loop(LabelMat, isPartSeg)
+
+    im = np.uint8(255*LabelMat.astype(np.float32)/LabelMat.max())
+    edges = cv2.Canny(im, 50, 100) + cv2.Canny(255-im, 50, 100)
+    r, c = np.where(edges)
+
+    # A point is invalid if any label in its 3x3 neighbourhood is. Pixels
+    # outside the image are ignored by the dilation, as by the slicing.
+    kernel = np.ones((3, 3), dtype=np.uint8)
+    invalidPupil = cv2.dilate(np.uint8((LabelMat == 0) | (LabelMat == 1)), kernel)
+    if isPartSeg:
+        invalidIris = cv2.dilate(np.uint8((LabelMat == 0) | (LabelMat == 3)), kernel)
+    else:
+        invalidIris = cv2.dilate(np.uint8(LabelMat == 3), kernel)
+
+    # The neighbourhood of the first row and column is empty
+    inside = (r > 0) & (c > 0)
+    pts = np.stack([c, r], axis=1)
+    pupilPts = pts[inside & (invalidPupil[r, c] == 0)]
+    irisPts = pts[inside & (invalidIris[r, c] == 0)]
+    pupilPts = pupilPts if len(pupilPts) > 0 else []
+    irisPts = irisPts if len(irisPts) > 0 else []
+    return pupilPts, irisPts
+
+def getValidPoints_loop(LabelMat, isPartSeg=True):
+    '''
+    The reference implementation of getValidPoints, visiting each edge point.
+    '''
     im = np.uint8(255*LabelMat.astype(np.float32)/LabelMat.max())
     edges = cv2.Canny(im, 50, 100) + cv2.Canny(255-im, 50, 100)
     r, c = np.where(edges)
@@ -14,6 +14,9 @@ class Config(BaseModel):
 
 
 class Detector(AbstractDetector):
+    # The native detector does not accept read-only buffers
+    writable_frames = True
+
     def __init__(self, _: Config = Config()):
         self._detector = Detector2D()
 
@@ -1,12 +1,20 @@
 # This small script generates appropiate containers for different depending images
 
 import re
+import hashlib
 import argparse
 from pathlib import Path
-from subprocess import run
+from subprocess import run, PIPE, STDOUT, DEVNULL
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Mapping, Optional
 
+# The label storing the hash of the inputs an image was built from
+LABEL_BUILD_HASH = "ommatidia.build-hash"
+
+# Files not affecting the image which are created during development
+IGNORED_PARTS = ("__pycache__", ".pytest_cache", ".mypy_cache")
+
 
 @dataclass(eq=True, frozen=True)
 class ImageDefinition:
@@ -17,19 +25,90 @@ class ImageDefinition:
     image_version: str
     version_opencv: str
 
-    def build(self):
+    def build(self, force: bool = False, quiet: bool = False) -> bool:
         """
-        Build a new image given the parameters.
+        Build a new image given the parameters. The build is skipped if an image with the same inputs exists.
         """
 
-        arguments = ["docker", "build", "-t", str(self)]
+        build_hash = self.build_hash()
+        if not force and self._existing_build_hash() == build_hash:
+            print(f"Image '{self}' is up to date")
+            return True
+
+        arguments = [
+            "docker",
+            "build",
+            "-t",
+            str(self),
+            "--label",
+            f"{LABEL_BUILD_HASH}={build_hash}",
+        ]
 
         for name, version in self._docker_args().items():
             arguments.append("--build-arg")
             arguments.append(f"{name}={version}")
         arguments.append(".")
 
-        run(arguments, cwd=self._template_path(), check=False)
+        # Concurrent builds would interleave their output
+        result = run(
+            arguments,
+            cwd=self._template_path(),
+            check=False,
+            stdout=PIPE if quiet else None,
+            stderr=STDOUT if quiet else None,
+            universal_newlines=True,
+        )
+        if result.returncode != 0:
+            if quiet:
+                print(result.stdout)
+            print(f"Building image '{self}' failed")
+            return False
+
+        print(f"Image '{self}' built")
+        return True
+
+    def build_hash(self) -> str:
+        """
+        Hash the build context and the arguments the image is built from.
+        """
+
+        build_hash = hashlib.sha256(str(self).encode("utf-8"))
+        for name, version in sorted(self._docker_args().items()):
+            build_hash.update(f"\0{name}={version}".encode("utf-8"))
+
+        template_path = self._template_path()
+        for path in sorted(template_path.rglob("*")):
+            relative_path = path.relative_to(template_path)
+            if not path.is_file() or path.suffix == ".pyc" or any(
+                part in IGNORED_PARTS for part in relative_path.parts
+            ):
+                continue
+            build_hash.update(f"\0{relative_path.as_posix()}\0".encode("utf-8"))
+            build_hash.update(path.read_bytes())
+        return build_hash.hexdigest()
+
+    def _existing_build_hash(self) -> Optional[str]:
+        """
+        Query the hash the existing image was built from, if any.
+        """
+
+        result = run(
+            [
+                "docker",
+                "image",
+                "inspect",
+                "--format",
+                f'{{{{ index .Config.Labels "{LABEL_BUILD_HASH}" }}}}',
+                str(self),
+            ],
+            check=False,
+            stdout=PIPE,
+            stderr=DEVNULL,
+            universal_newlines=True,
+        )
+        if result.returncode != 0:
+            return None
+        return result.stdout.strip()
 
     def _docker_args(self) -> Mapping[str, str]:
         """
@@ -162,6 +241,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "path", type=str, help="folder containing (possible multiple) detectors"
     )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="rebuild images even if they are up to date"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="the number of images built concurrently"
+    )
     args = parser.parse_args()
 
     # Parse all the files within
@@ -174,6 +259,14 @@ if __name__ == "__main__":
         if image_definition is not None
     )
 
-    # Build all the different detectors
-    for definition in image_definitions:
-        definition.build()
+    # Build all the different detectors. The base images do not depend on each other.
+    jobs = max(args.jobs, 1)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(
+            executor.map(
+                lambda definition: definition.build(force=args.force, quiet=jobs > 1),
+                image_definitions,
+            )
+        )
+    if not all(results):
+        raise SystemExit(1)
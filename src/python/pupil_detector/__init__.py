@@ -1,9 +1,46 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Sequence
+
+import numpy as np
+
 from .models.meta_data import MetaData
 
+# Models shared between all detector instances of this process
+_SHARED_MODELS: Dict[Hashable, Any] = {}
+_SHARED_MODELS_LOCK = threading.Lock()
+
 
 class AbstractDetector:
     """The abstract base for all detectors"""
 
+    # Raw samples are handed to the detector without copying them, so their frames are read-only. Detectors
+    # modifying frames in place or passing them to native code requiring writable buffers receive copies instead.
+    writable_frames = False
+
+    def detect(self, frame: np.ndarray) -> Any:
+        """Evaluate a single grayscale frame. It may be read-only unless "writable_frames" is set."""
+        raise NotImplementedError("The pupil detector must override the detection")
+
+    def detect_batch(self, frames: Sequence[np.ndarray]) -> List[Any]:
+        """
+        Evaluate multiple grayscale frames at once. Detectors capable of processing
+        batches natively, i.e. in a single forward pass of a network, should override it.
+        """
+        return [self.detect(frame) for frame in frames]
+
+    @staticmethod
+    def shared_model(key: Hashable, load: Callable[[], Any]) -> Any:
+        """
+        Load a model only once per process and share it between all detector instances using the same key,
+        i.e. the configuration they were created with. The shared model must not be modified afterwards.
+        """
+        with _SHARED_MODELS_LOCK:
+            model = _SHARED_MODELS.get(key)
+            if model is None:
+                model = load()
+                _SHARED_MODELS[key] = model
+            return model
+
     @classmethod
     def metadata(cls) -> MetaData:
         """Yield the meta data of the detector."""
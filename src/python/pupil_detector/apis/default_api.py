@@ -1,6 +1,7 @@
 # coding: utf-8
 
-from fastapi import APIRouter, Response
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from ..detector import Detector, Config
 from ..models.meta_data import MetaData
@@ -40,3 +41,45 @@ async def get_config_schema() -> Response:
 async def get_meta_data() -> MetaData:
     """Yield the meta data for the pupil detection algorithm."""
     return Detector.metadata()
+
+
+@router.get(
+    "/ready/",
+    responses={
+        200: {"description": "The detector is ready to serve requests."},
+        503: {"description": "The detector is still loading its models or failed to do so."},
+    },
+    tags=["default"],
+    summary="Check whether the detector finished its warm-up",
+    response_model_by_alias=True,
+)
+async def get_readiness(request: Request) -> Response:
+    """Yield whether the models of the detector are loaded and initialized."""
+    error = request.app.state.warm_up_error
+    if error is not None:
+        return JSONResponse(content=f"The warm-up failed: {error}", status_code=503)
+    if not request.app.state.ready:
+        return JSONResponse(content="The detector is warming up", status_code=503)
+    return JSONResponse(content="The detector is ready")
+
+
+# Prometheus scrapes "/metrics" by default, so it is served without redirect as well
+@router.get("/metrics", include_in_schema=False)
+@router.get(
+    "/metrics/",
+    responses={
+        200: {"description": "The metrics in the text-based exposition format of Prometheus."},
+    },
+    tags=["default"],
+    summary="Get counters and latencies of the server",
+    response_model_by_alias=True,
+)
+async def get_metrics(request: Request) -> Response:
+    """Yield the request counters, the latencies of the detection stages, the queue depth, and the memory usage."""
+    state = request.app.state
+    # Count only the instances not expired in the meantime
+    state.detectors.evict_idle()
+    return PlainTextResponse(
+        content=state.metrics.render(queue_depth=state.executor.pending, instances=len(state.detectors)),
+        media_type="text/plain; version=0.0.4",
+    )
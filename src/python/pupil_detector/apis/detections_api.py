@@ -1,31 +1,49 @@
 # coding: utf-8
 
-from typing import List, Union, Optional
+import asyncio
+import collections
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Union, Optional, Tuple
 
 from fastapi import (
     APIRouter,
     HTTPException,
     Path,
+    Query,
     Request,
 )
-from fastapi.responses import JSONResponse
-import cv2 as cv
-import numpy as np
-
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from ..models.point import Point
 from ..models.ellipse import Ellipse
-from ..models.mask import Mask
-from ..models.sample import Sample
+from ..models.mask import Mask, MaskEncoding
 from ..detector import Detector, Config
+from ..encoding import (
+    MEDIA_TYPE_BINARY,
+    STREAM_INDEX,
+    accepts_binary,
+    accepts_json,
+    encode_prediction,
+    encode_predictions,
+)
+from ..executor import BusyError, InvalidSampleError
+from ..frames import FrameParser, split_frames
+from ..metrics import server_timing
+from ..registry import RegistryFullError
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 
 @router.post(
     "/detections/",
     responses={
         200: {"description": "Instance successfully created."},
         400: {"model": str, "description": "The given configuration is invalid."},
+        503: {"description": "The maximal number of instances is reached."},
     },
     tags=["Detections"],
     summary="Initialize a new pupil detection algorithm with specific configuration.",
@@ -36,9 +54,13 @@ async def create_detector(request: Request, config: Optional[Config] = None) ->
     Initialize a new pupil detection algorithm with specific configuration.
     """
     detectors = request.app.state.detectors
-    detector_id = len(detectors)
-    detectors.append(Detector(config if config is not None else Config()))
-    return detector_id
+    try:
+        # Fail fast before loading the detector
+        detectors.reserve()
+        detector = await request.app.state.executor.create(config if config is not None else Config())
+        return detectors.add(detector)
+    except RegistryFullError as ex:
+        raise HTTPException(status_code=503, detail=str(ex))
 
 
 @router.get(
@@ -62,8 +84,7 @@ async def get_detector(
     """
     Query an pupil detection algorithm and its configuration.
     """
-    detectors = request.app.state.detectors
-    if detector_id >= len(detectors) or detectors[detector_id] is None:
+    if request.app.state.detectors.get(detector_id) is None:
         return JSONResponse(content="The selected ID was not found", status_code=404)
     return {}
 
@@ -89,18 +110,17 @@ async def delete_detector(
     """
     Delete the instance of the pupil detection algorithm and remove all associated resources.
     """
-    detectors = request.app.state.detectors
-    if detector_id >= len(detectors) or detectors[detector_id] is None:
+    if not request.app.state.detectors.remove(detector_id):
         raise HTTPException(status_code=404, detail="The selected ID was not found")
 
-    detectors[detector_id] = None
-
 
 @router.post(
     "/detections/{detector_id}/",
     responses={
         200: {"description": "The estimated pupil center."},
         404: {"description": "The selected ID was not found"},
+        406: {"description": "The prediction can not be encoded as requested."},
+        503: {"description": "The detector is busy. Retry after the given time."},
     },
     tags=["Detections"],
     summary="Evaluate a given image with the configured pupil detection algorihm.",
@@ -113,28 +133,165 @@ async def detect(
         description="Identifier for the running instance of pupil detection algorithm.",
         ge=0,
     ),
+    width: Optional[int] = Query(
+        None,
+        description="The width of the samples if they are sent as raw 8-bit grayscale pixels.",
+        gt=0,
+    ),
+    height: Optional[int] = Query(
+        None,
+        description="The height of the samples if they are sent as raw 8-bit grayscale pixels.",
+        gt=0,
+    ),
+    mask_encoding: MaskEncoding = Query(
+        MaskEncoding.LIST,
+        description="The representation of predicted masks.",
+    ),
 ) -> Union[Point, Ellipse, Mask]:
     """
     Evaluate a given image with the configured pupil detection algorihm.
+    Alternatively, raw 8-bit grayscale pixels may be sent as "application/octet-stream" with the dimensions given.
     """
-    detectors = request.app.state.detectors
-    detector = None if detector_id >= len(detectors) else detectors[detector_id]
-    if detector is None:
-        raise HTTPException(status_code=404, detail="The selected ID was not found")
+    detector = _find_detector(request, detector_id)
+    binary = _use_binary_encoding(request)
+    shape = _raw_shape(width, height)
+    if shape is None and _is_raw(request):
+        raise HTTPException(status_code=400, detail="The dimensions of raw samples must be specified")
 
-    # Try to decode the image from bytes
+    start = time.perf_counter()
     image_data: bytes = await request.body()
-    # Drop the dependency on OpenCV: Image.open(io.BytesIO(image_data)).convert('L')
-    image = cv.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv.IMREAD_GRAYSCALE)
-    if image is None:
+    read_duration = time.perf_counter() - start
+
+    # Decode the image and run the detector without blocking the event loop
+    try:
+        (prediction,), timings = await request.app.state.executor.detect(
+            detector, [image_data], shape, mask_encoding
+        )
+    except InvalidSampleError:
         raise HTTPException(status_code=400, detail="The provided sample is not valid")
 
-    # Run the detector
-    prediction = detector.detect(image)
+    timings["read"] = read_duration
+    return _respond(request, detector_id, timings, prediction, encode_prediction if binary else None)
 
-    # Enrich the result with the information regarding the sample
-    prediction.sample = Sample(width=image.shape[1], height=image.shape[0])
-    return prediction
+
+@router.post(
+    "/detections/{detector_id}/batch/",
+    responses={
+        200: {"description": "The estimated pupils in the order of the given samples."},
+        400: {"description": "The sequence or one of its samples is not valid"},
+        404: {"description": "The selected ID was not found"},
+        406: {"description": "The predictions can not be encoded as requested."},
+        503: {"description": "The detector is busy. Retry after the given time."},
+    },
+    tags=["Detections"],
+    summary="Evaluate a sequence of length-prefixed images with the configured pupil detection algorihm.",
+    response_model_by_alias=True,
+)
+async def detect_batch(
+    request: Request,
+    detector_id: int = Path(
+        None,
+        description="Identifier for the running instance of pupil detection algorithm.",
+        ge=0,
+    ),
+    width: Optional[int] = Query(
+        None,
+        description="The width of the samples if they are sent as raw 8-bit grayscale pixels.",
+        gt=0,
+    ),
+    height: Optional[int] = Query(
+        None,
+        description="The height of the samples if they are sent as raw 8-bit grayscale pixels.",
+        gt=0,
+    ),
+    mask_encoding: MaskEncoding = Query(
+        MaskEncoding.LIST,
+        description="The representation of predicted masks.",
+    ),
+) -> List[Union[Point, Ellipse, Mask]]:
+    """
+    Evaluate a sequence of images with the configured pupil detection algorihm.
+    Each encoded image is prefixed by its length in bytes as unsigned 32-bit integer (little endian).
+    If the dimensions are given, the images must consist of raw 8-bit grayscale pixels instead.
+    """
+    detector = _find_detector(request, detector_id)
+    binary = _use_binary_encoding(request)
+    shape = _raw_shape(width, height)
+
+    start = time.perf_counter()
+    try:
+        encoded_images = split_frames(await request.body())
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=f"The provided sequence is not valid: {ex}")
+    read_duration = time.perf_counter() - start
+
+    # Run the detector on all the samples at once
+    try:
+        predictions, timings = await request.app.state.executor.detect(
+            detector, encoded_images, shape, mask_encoding
+        )
+    except InvalidSampleError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+
+    timings["read"] = read_duration
+    return _respond(request, detector_id, timings, predictions, encode_predictions if binary else None)
+
+
+@router.post(
+    "/detections/{detector_id}/stream/",
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "One JSON line per sample with its index and the estimated pupil or an error.",
+        },
+        404: {"description": "The selected ID was not found"},
+        406: {"description": "The predictions can not be encoded as requested."},
+    },
+    tags=["Detections"],
+    summary="Evaluate a continuous stream of length-prefixed images with the configured pupil detection algorihm.",
+    response_model_by_alias=True,
+)
+async def detect_stream(
+    request: Request,
+    detector_id: int = Path(
+        None,
+        description="Identifier for the running instance of pupil detection algorithm.",
+        ge=0,
+    ),
+    depth: int = Query(
+        2,
+        description="The number of samples processed concurrently, i. e. decoded while the previous one is evaluated.",
+        ge=1,
+        le=64,
+    ),
+    width: Optional[int] = Query(
+        None,
+        description="The width of the samples if they are sent as raw 8-bit grayscale pixels.",
+        gt=0,
+    ),
+    height: Optional[int] = Query(
+        None,
+        description="The height of the samples if they are sent as raw 8-bit grayscale pixels.",
+        gt=0,
+    ),
+    mask_encoding: MaskEncoding = Query(
+        MaskEncoding.LIST,
+        description="The representation of predicted masks.",
+    ),
+) -> StreamingResponse:
+    """
+    Evaluate a continuous stream of images, i. e. sent by chunked transfer encoding, with the configured pupil
+    detection algorihm. Each encoded image is prefixed by its length in bytes as unsigned 32-bit integer
+    (little endian). If the dimensions are given, the images must consist of raw 8-bit grayscale pixels instead.
+    The predictions are sent back in order as soon as they are available.
+    """
+    detector = _find_detector(request, detector_id)
+    binary = _use_binary_encoding(request)
+    shape = _raw_shape(width, height)
+    return _PipelinedStreamingResponse(
+        _stream_predictions(request, detector_id, detector, depth, shape, mask_encoding, binary),
+        media_type=MEDIA_TYPE_BINARY if binary else "application/x-ndjson",
+    )
 
 
 @router.get(
@@ -155,8 +312,151 @@ async def get_detectors(
     """
     Returns a list of running pupil detection algorithms.
     """
-    return [
-        i
-        for i, detector in enumerate(request.app.state.detectors)
-        if detector is not None
-    ]
+    return request.app.state.detectors.ids()
+
+
+def _find_detector(request: Request, detector_id: int) -> Any:
+    """
+    Query a running detector or raise a HTTP error if it does not exists.
+    """
+    detector = request.app.state.detectors.get(detector_id)
+    if detector is None:
+        raise HTTPException(status_code=404, detail="The selected ID was not found")
+    return detector
+
+
+def _respond(
+    request: Request,
+    detector_id: int,
+    timings: Dict[str, float],
+    content: Any,
+    binary_encoder: Optional[Callable[[Any], bytes]],
+) -> Response:
+    """
+    Serialize the predictions and report the durations of the stages within the "Server-Timing" header.
+    """
+    start = time.perf_counter()
+    if binary_encoder is not None:
+        response = Response(content=binary_encoder(content), media_type=MEDIA_TYPE_BINARY)
+    else:
+        response = JSONResponse(content=jsonable_encoder(content))
+    timings["serialize"] = timings.get("serialize", 0.0) + time.perf_counter() - start
+
+    request.app.state.metrics.observe_stages(detector_id, timings)
+    response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+
+def _raw_shape(width: Optional[int], height: Optional[int]) -> Optional[Tuple[int, int]]:
+    """
+    Yield the shape of raw samples, if specified.
+    """
+    if width is None and height is None:
+        return None
+    if width is None or height is None:
+        raise HTTPException(status_code=400, detail="Both width and height of raw samples must be specified")
+    return height, width
+
+
+def _is_raw(request: Request) -> bool:
+    """
+    Check whether the sample is sent as raw pixels, ignoring parameters of the media type like the charset.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    return media_type == "application/octet-stream"
+
+
+def _use_binary_encoding(request: Request) -> bool:
+    """
+    Check whether the predictions should be encoded in the compact binary layout.
+    """
+    if not accepts_binary(request):
+        return False
+    if Detector.metadata().prediction != "Mask":
+        return True
+    if accepts_json(request):
+        # Masks are sent as JSON to clients accepting both
+        return False
+    raise HTTPException(status_code=406, detail="Masks can not be encoded in the binary layout")
+
+
+class _PipelinedStreamingResponse(StreamingResponse):
+    """
+    A streaming response whose content still consumes the body of the request. Consequently, it must not
+    listen for the disconnect of the client concurrently as the original implementation does.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _stream_predictions(
+    request: Request,
+    detector_id: int,
+    detector: Any,
+    depth: int,
+    shape: Optional[Tuple[int, int]],
+    mask_encoding: MaskEncoding,
+    binary: bool,
+) -> AsyncIterator[bytes]:
+    executor = request.app.state.executor
+    metrics = request.app.state.metrics
+    parser = FrameParser()
+    pending = collections.deque()
+    index = 0
+    try:
+        async for chunk in request.stream():
+            for frame in parser.feed(chunk):
+                future = asyncio.ensure_future(executor.detect(detector, [frame], shape, mask_encoding))
+                pending.append((index, future))
+                index += 1
+
+                # Limit the samples in flight. Awaiting the oldest one stops reading from the client.
+                while len(pending) > depth:
+                    entry, timings = await _stream_entry(*pending.popleft(), binary=binary)
+                    metrics.observe_stages(detector_id, timings)
+                    yield entry
+
+        while len(pending) > 0:
+            entry, timings = await _stream_entry(*pending.popleft(), binary=binary)
+            metrics.observe_stages(detector_id, timings)
+            yield entry
+
+        if not parser.is_complete:
+            yield _encode_stream_entry(index, None, "The stream ended within a sample", binary)
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+async def _stream_entry(index: int, future: asyncio.Future, binary: bool) -> Tuple[bytes, Dict[str, float]]:
+    try:
+        (prediction,), timings = await future
+    except InvalidSampleError:
+        return _encode_stream_entry(index, None, "The provided sample is not valid", binary), {}
+    except BusyError as ex:
+        return _encode_stream_entry(index, None, str(ex), binary), {}
+    except Exception as ex:
+        # The response is already started, so a failing sample must not end the stream
+        logger.exception("The detection of sample %d failed", index)
+        return _encode_stream_entry(index, None, f"The detection failed: {ex}", binary), {}
+
+    start = time.perf_counter()
+    entry = _encode_stream_entry(index, prediction, None, binary)
+    timings["serialize"] = timings.get("serialize", 0.0) + time.perf_counter() - start
+    return entry, timings
+
+
+def _encode_stream_entry(index: int, prediction: Optional[Any], error: Optional[str], binary: bool) -> bytes:
+    # The binary encoding has no room for the error message and marks the prediction as missing instead
+    if binary:
+        return STREAM_INDEX.pack(index) + encode_prediction(prediction)
+
+    entry = {"frame": index}
+    if prediction is not None:
+        entry["prediction"] = jsonable_encoder(prediction)
+    if error is not None:
+        entry["error"] = error
+    return (json.dumps(entry) + "\n").encode("utf-8")
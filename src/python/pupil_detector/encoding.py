@@ -0,0 +1,93 @@
+# coding: utf-8
+
+import struct
+from typing import Any, Dict, Optional, Sequence
+
+from starlette.requests import Request
+
+MEDIA_TYPE_BINARY = "application/x-ommatidia-prediction"
+
+# x, y, major, minor, rotation, confidence, width, height in little endian. Missing values are NaN.
+PREDICTION = struct.Struct("<6d2I")
+
+# The index of a sample within a stream preceding its prediction
+STREAM_INDEX = struct.Struct("<I")
+
+_NAN = float("nan")
+
+_JSON_RANGES = ("application/json", "application/*", "*/*")
+
+
+def accepts_binary(request: Request) -> bool:
+    """
+    Check whether the client asked for the compact binary encoding of predictions. It has to be requested
+    explicitly and is not used if the client rates JSON higher.
+    """
+    qualities = _media_ranges(request.headers.get("accept", ""))
+    binary = qualities.get(MEDIA_TYPE_BINARY, 0.0)
+    return binary > 0.0 and binary >= _json_quality(qualities)
+
+
+def accepts_json(request: Request) -> bool:
+    """
+    Check whether the client accepts predictions encoded as JSON, which is the case without an "Accept" header.
+    """
+    qualities = _media_ranges(request.headers.get("accept", ""))
+    return len(qualities) == 0 or _json_quality(qualities) > 0.0
+
+
+def _json_quality(qualities: Dict[str, float]) -> float:
+    # The most specific range matching JSON applies
+    return next((qualities[media_range] for media_range in _JSON_RANGES if media_range in qualities), 0.0)
+
+
+def _media_ranges(accept: str) -> Dict[str, float]:
+    """
+    Parse the media ranges of an "Accept" header into their quality. Malformed qualities are not acceptable.
+    """
+    qualities = {}
+    for entry in accept.split(","):
+        media_range, *parameters = entry.split(";")
+        media_range = media_range.strip().lower()
+        if not media_range:
+            continue
+
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities.setdefault(media_range, quality)
+    return qualities
+
+
+def encode_prediction(prediction: Optional[Any]) -> bytes:
+    """
+    Encode a point or an ellipse into the fixed binary layout without validating or converting it to a dict first.
+    Missing predictions, i. e. due to invalid samples, are encoded with NaN values and empty dimensions.
+    """
+    if prediction is None:
+        return PREDICTION.pack(_NAN, _NAN, _NAN, _NAN, _NAN, _NAN, 0, 0)
+
+    confidence = prediction.confidence
+    sample = prediction.sample
+    return PREDICTION.pack(
+        prediction.x,
+        prediction.y,
+        getattr(prediction, "major", _NAN),
+        getattr(prediction, "minor", _NAN),
+        getattr(prediction, "rotation", _NAN),
+        _NAN if confidence is None else confidence,
+        0 if sample is None else sample.width,
+        0 if sample is None else sample.height,
+    )
+
+
+def encode_predictions(predictions: Sequence[Any]) -> bytes:
+    """
+    Encode multiple predictions as a contiguous array of fixed-size records.
+    """
+    return b"".join(encode_prediction(prediction) for prediction in predictions)
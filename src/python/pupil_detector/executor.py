@@ -0,0 +1,282 @@
+# coding: utf-8
+
+import asyncio
+import functools
+import itertools
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from .detector import Detector, Config
+from .frames import decode_frame, wrap_raw_frame
+from .metrics import collect_stages, stage
+from .models.mask import Mask, MaskEncoding
+from .models.sample import Sample
+
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidSampleError(Exception):
+    """
+    A sample given to the detector could not be decoded.
+    """
+
+    def __init__(self, index: int):
+        super().__init__(f"The provided sample {index} is not valid")
+        self.index = index
+
+
+class BusyError(Exception):
+    """
+    The number of pending requests exceeds the capacity of the executor.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("The detector is busy, please try again later")
+        self.retry_after = retry_after
+
+
+class _ThreadHandle:
+    """
+    A detector living in the server process. Detectors are not expected to be thread-safe.
+    """
+
+    def __init__(self, detector: Detector):
+        self.detector = detector
+        self.lock = threading.Lock()
+
+
+class _ProcessHandle:
+    """
+    A detector instantiated lazily within each worker process.
+    """
+
+    def __init__(self, key: int, config: str):
+        self.key = key
+        self.config = config
+
+
+class DetectionExecutor:
+    """
+    Runs the blocking decoding and detection outside of the event loop and limits the number of pending requests.
+    Native detectors releasing the GIL are best served by threads, pure Python ones by processes.
+    """
+
+    def __init__(
+        self,
+        kind: str = EXECUTOR_THREAD,
+        workers: Optional[int] = None,
+        queue_size: int = 64,
+        retry_after: int = 1,
+    ):
+        if kind not in (EXECUTOR_THREAD, EXECUTOR_PROCESS):
+            raise ValueError(f"Unknown executor '{kind}'")
+
+        self.kind = kind
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self.pending = 0
+        self._keys = itertools.count()
+        self._live_keys: FrozenSet[int] = frozenset()
+        self._threads = ThreadPoolExecutor(self.workers)
+        self._processes = ProcessPoolExecutor(self.workers) if kind == EXECUTOR_PROCESS else None
+
+    @staticmethod
+    def from_environment() -> "DetectionExecutor":
+        """
+        Configure the executor using the environment variables of the container.
+        """
+        workers = os.environ.get("PUPIL_DETECTOR_WORKERS")
+        return DetectionExecutor(
+            kind=os.environ.get("PUPIL_DETECTOR_EXECUTOR", EXECUTOR_THREAD),
+            workers=int(workers) if workers else None,
+            queue_size=int(os.environ.get("PUPIL_DETECTOR_QUEUE_SIZE", 64)),
+            retry_after=int(os.environ.get("PUPIL_DETECTOR_RETRY_AFTER", 1)),
+        )
+
+    async def create(self, config: Config) -> Any:
+        """
+        Create an opaque handle of a new detector instance.
+        """
+        if self._processes is not None:
+            handle = _ProcessHandle(next(self._keys), config.json())
+            # Create the instance in one of the workers, so invalid configurations are rejected right away
+            await self._run(self._processes, _create_in_worker, handle.key, handle.config)
+            self._live_keys = self._live_keys | {handle.key}
+            return handle
+        detector = await self._run(self._threads, Detector, config)
+        return _ThreadHandle(detector)
+
+    async def warm_up(self, config: Config) -> None:
+        """
+        Load the models of a detector with the given configuration and run a first detection in every worker,
+        so its instances do not pay the costs on their first request. With worker processes, this is best effort:
+        the pool may hand several warm-up tasks to the same process, leaving others cold.
+        """
+        if self._processes is None:
+            await self._run(self._threads, _warm_up, config.json())
+        else:
+            # Each worker process holds its own models. Submitting a task per worker reaches most, not all of them.
+            await asyncio.gather(
+                *[self._run(self._processes, _warm_up, config.json()) for _ in range(self.workers)]
+            )
+
+    def release(self, handle: Any) -> None:
+        """
+        Free the resources of a detector no longer used.
+        """
+        if isinstance(handle, _ProcessHandle):
+            # The worker processes drop their instances on their next detection
+            self._live_keys = self._live_keys - {handle.key}
+
+    async def detect(
+        self,
+        handle: Any,
+        encoded_frames: Sequence[bytes],
+        shape: Optional[Tuple[int, int]] = None,
+        mask_encoding: MaskEncoding = MaskEncoding.LIST,
+    ) -> Tuple[List[Any], Dict[str, float]]:
+        """
+        Decode the given frames and run the detector on them. Raises InvalidSampleError on invalid samples.
+        If the shape (height, width) is given, the frames are expected to contain raw grayscale pixels.
+        Predicted masks are represented in the given encoding. Yields the predictions and the durations of
+        the stages in seconds.
+        """
+        if isinstance(handle, _ProcessHandle):
+            # Memory views are not pickable
+            encoded_frames = [bytes(frame) for frame in encoded_frames]
+            return await self._run(
+                self._processes,
+                _detect_in_worker,
+                handle.key,
+                handle.config,
+                self._live_keys,
+                encoded_frames,
+                shape,
+                mask_encoding,
+            )
+        return await self._run(self._threads, _detect_locked, handle, encoded_frames, shape, mask_encoding)
+
+    def shutdown(self) -> None:
+        """
+        Stop all the workers.
+        """
+        self._threads.shutdown(wait=False)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False)
+
+    async def _run(self, pool, function, *args) -> Any:
+        if self.pending >= self.queue_size:
+            raise BusyError(self.retry_after)
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(function, *args))
+        finally:
+            self.pending -= 1
+
+
+def _decode(encoded_frames: Sequence[bytes], shape: Optional[Tuple[int, int]]) -> List[np.ndarray]:
+    frames = []
+    with stage("decode"):
+        for i, encoded_frame in enumerate(encoded_frames):
+            if shape is None:
+                frame = decode_frame(encoded_frame)
+            else:
+                frame = wrap_raw_frame(encoded_frame, width=shape[1], height=shape[0])
+            if frame is None:
+                raise InvalidSampleError(i)
+            frames.append(frame)
+    return frames
+
+
+def _detect(detector: Detector, frames: List[np.ndarray], mask_encoding: MaskEncoding) -> List[Any]:
+    if detector.writable_frames:
+        with stage("decode"):
+            frames = [frame if frame.flags.writeable else frame.copy() for frame in frames]
+
+    with stage("infer"):
+        if len(frames) == 1:
+            predictions = [detector.detect(frames[0])]
+        elif len(frames) > 1:
+            predictions = detector.detect_batch(frames)
+        else:
+            predictions = []
+
+    # Enrich the results with the information regarding the samples
+    for prediction, frame in zip(predictions, frames):
+        prediction.sample = Sample(width=frame.shape[1], height=frame.shape[0])
+
+    # Encode the masks within the worker instead of the event loop
+    with stage("serialize"):
+        return [
+            prediction.encode(mask_encoding) if isinstance(prediction, Mask) else prediction
+            for prediction in predictions
+        ]
+
+
+def _detect_locked(
+    handle: _ThreadHandle,
+    encoded_frames: Sequence[bytes],
+    shape: Optional[Tuple[int, int]],
+    mask_encoding: MaskEncoding,
+) -> Tuple[List[Any], Dict[str, float]]:
+    with collect_stages() as timings:
+        frames = _decode(encoded_frames, shape)
+        with handle.lock:
+            predictions = _detect(handle.detector, frames, mask_encoding)
+    return predictions, timings
+
+
+# The detector instances owned by a worker process
+_worker_detectors: Dict[int, Detector] = {}
+
+
+def _detect_in_worker(
+    key: int,
+    config: str,
+    live_keys: FrozenSet[int],
+    encoded_frames: Sequence[bytes],
+    shape: Optional[Tuple[int, int]],
+    mask_encoding: MaskEncoding,
+) -> Tuple[List[Any], Dict[str, float]]:
+    for stale_key in [stale_key for stale_key in _worker_detectors if stale_key not in live_keys]:
+        del _worker_detectors[stale_key]
+
+    detector = _worker_detector(key, config)
+    with collect_stages() as timings:
+        predictions = _detect(detector, _decode(encoded_frames, shape), mask_encoding)
+    return predictions, timings
+
+
+def _create_in_worker(key: int, config: str) -> None:
+    _worker_detector(key, config)
+
+
+def _worker_detector(key: int, config: str) -> Detector:
+    detector = _worker_detectors.get(key)
+    if detector is None:
+        detector = Detector(Config.parse_raw(config))
+        _worker_detectors[key] = detector
+    return detector
+
+
+def _warm_up(config: str) -> None:
+    detector = Detector(Config.parse_raw(config))
+
+    # Some detectors may fail on artificial samples, but their models are initialized anyway
+    frame = np.full((480, 640), 160, dtype=np.uint8)
+    cv.ellipse(frame, (320, 240), (40, 30), 0, 0, 360, 20, -1)
+    try:
+        detector.detect(frame)
+    except Exception as ex:
+        logger.warning("The warm-up detection failed: %s", ex)
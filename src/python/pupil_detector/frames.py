@@ -0,0 +1,89 @@
+# coding: utf-8
+
+import struct
+from typing import List, Optional
+
+import cv2 as cv
+import numpy as np
+
+# Each frame within a sequence is prefixed by its length as unsigned 32-bit integer (little endian)
+FRAME_LENGTH = struct.Struct("<I")
+
+
+def decode_frame(data: bytes) -> Optional[np.ndarray]:
+    """
+    Decode an encoded image into a grayscale frame. Returns None if the data is not a valid image.
+    """
+    # Drop the dependency on OpenCV: Image.open(io.BytesIO(image_data)).convert('L')
+    return cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_GRAYSCALE)
+
+
+def wrap_raw_frame(data: bytes, width: int, height: int) -> Optional[np.ndarray]:
+    """
+    Interpret raw 8-bit grayscale pixels in row-major order as frame without decoding or copying them, so the
+    frame is read-only. Returns None if the size of the data does not match the dimensions.
+    """
+    if width <= 0 or height <= 0 or len(data) != width * height:
+        return None
+    return np.frombuffer(data, dtype=np.uint8).reshape(height, width)
+
+
+def split_frames(data: bytes) -> List[memoryview]:
+    """
+    Split a length-prefixed sequence of encoded frames without copying them.
+    """
+    frames = []
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + FRAME_LENGTH.size > len(view):
+            raise ValueError(f"Truncated length prefix at byte {offset}")
+        (length,) = FRAME_LENGTH.unpack_from(view, offset)
+        offset += FRAME_LENGTH.size
+        if offset + length > len(view):
+            raise ValueError(f"Frame {len(frames)} is truncated")
+        frames.append(view[offset : offset + length])
+        offset += length
+    return frames
+
+
+def join_frames(frames: List[bytes]) -> bytes:
+    """
+    Create a length-prefixed sequence of encoded frames.
+    """
+    return b"".join(FRAME_LENGTH.pack(len(frame)) + bytes(frame) for frame in frames)
+
+
+class FrameParser:
+    """
+    Incrementally split a length-prefixed sequence of encoded frames arriving in chunks of arbitrary size.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """
+        Append a chunk and yield all the frames completed by it.
+        """
+        self._buffer.extend(chunk)
+
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= FRAME_LENGTH.size:
+            (length,) = FRAME_LENGTH.unpack_from(self._buffer, offset)
+            end = offset + FRAME_LENGTH.size + length
+            if end > len(self._buffer):
+                break
+            frames.append(bytes(self._buffer[offset + FRAME_LENGTH.size : end]))
+            offset = end
+
+        del self._buffer[:offset]
+        return frames
+
+    @property
+    def is_complete(self) -> bool:
+        """
+        Check whether no partial frame is remaining.
+        """
+        return len(self._buffer) == 0
@@ -10,11 +10,20 @@
 """
 
 
+import asyncio
+import logging
+import os
+from typing import Optional
+
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 
 from .apis.detections_api import router as DetectionsApiRouter
 from .apis.default_api import router as DefaultApiRouter
+from .detector import Config
+from .executor import BusyError, DetectionExecutor
+from .metrics import Metrics, MetricsMiddleware
+from .registry import DetectorRegistry
 
 app = FastAPI(
     title="Ommatidia",
@@ -32,7 +41,61 @@ async def validation_exception_handler(request, err):
     )
 
 
+@app.exception_handler(BusyError)
+async def busy_exception_handler(_request, err):
+    # Ask the client to slow down instead of queuing requests indefinitely
+    return JSONResponse(
+        status_code=503,
+        content={"message": str(err)},
+        headers={"Retry-After": str(err.retry_after)},
+    )
+
+
+@app.on_event("startup")
+def start_warm_up():
+    # Serve requests like the readiness probe while the models are loaded
+    if os.environ.get("PUPIL_DETECTOR_WARM_UP", "1") == "0":
+        app.state.ready = True
+    else:
+        # The event loop holds tasks only weakly, so the task is kept until it is done
+        app.state.warm_up = asyncio.ensure_future(warm_up())
+
+
+async def warm_up():
+    try:
+        await app.state.executor.warm_up(Config())
+    except asyncio.CancelledError:
+        # Before Python 3.8, the cancellation is an ordinary exception
+        raise
+    except Exception as ex:
+        # Report the failure instead of pretending to be ready
+        logging.getLogger(__name__).exception("Unable to warm up the detector")
+        app.state.warm_up_error = str(ex)
+        return
+    app.state.ready = True
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    if app.state.warm_up is not None:
+        app.state.warm_up.cancel()
+    app.state.executor.shutdown()
+
+
+def release_detector(detector_id: Optional[int], handle) -> None:
+    app.state.executor.release(handle)
+    if detector_id is not None:
+        app.state.metrics.forget_detector(detector_id)
+
+
 app.include_router(DetectionsApiRouter)
 app.include_router(DefaultApiRouter)
 
-app.state.detectors = []
+app.state.metrics = Metrics()
+app.add_middleware(MetricsMiddleware, metrics=app.state.metrics)
+
+app.state.ready = False
+app.state.warm_up = None
+app.state.warm_up_error = None
+app.state.executor = DetectionExecutor.from_environment()
+app.state.detectors = DetectorRegistry.from_environment(on_remove=release_detector)
@@ -0,0 +1,214 @@
+# coding: utf-8
+
+import bisect
+import collections
+import contextlib
+import itertools
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# The upper bounds of the latency histograms in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Measure the duration of a stage within the detection, i.e. the forward pass of a network. Repeated stages
+    are summed up. Detectors may use it freely, as it does nothing if no timings are collected.
+    """
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def collect_stages() -> Iterator[Dict[str, float]]:
+    """
+    Collect the durations of all the stages measured in the current thread.
+    """
+    previous = getattr(_local, "timings", None)
+    timings = {}
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """
+    Format the durations of the stages as value of the "Server-Timing" header in milliseconds.
+    """
+    order = {"read": 0, "decode": 1, "infer": 2, "serialize": 4}
+    stages = sorted(timings.items(), key=lambda item: order.get(item[0], 3))
+    return ", ".join(f"{name};dur={duration * 1000.0:.3f}" for name, duration in stages)
+
+
+class Histogram:
+    """
+    The distribution of observed durations.
+    """
+
+    def __init__(self):
+        # The last bucket holds the values exceeding all bounds
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """
+    Counters and latencies of the server exposed in the text format of Prometheus.
+    All observations are made from within the event loop.
+    """
+
+    def __init__(self):
+        self.requests = collections.Counter()
+        self.request_durations = collections.defaultdict(Histogram)
+        self.stage_durations = collections.defaultdict(Histogram)
+
+    def observe_request(self, method: str, handler: str, status: int, duration: float) -> None:
+        self.requests[(method, handler, str(status))] += 1
+        self.request_durations[(handler,)].observe(duration)
+
+    def observe_stages(self, detector_id: int, timings: Dict[str, float]) -> None:
+        for name, duration in timings.items():
+            self.stage_durations[(name, str(detector_id))].observe(duration)
+
+    def forget_detector(self, detector_id: int) -> None:
+        """
+        Drop the stage durations of a removed detector, as identifiers are never reused.
+        """
+        label = str(detector_id)
+        for labels in [labels for labels in self.stage_durations if labels[1] == label]:
+            del self.stage_durations[labels]
+
+    def render(self, queue_depth: int, instances: int) -> str:
+        """
+        Export all the metrics in the text-based exposition format.
+        """
+        lines = [
+            "# HELP ommatidia_requests_total The number of handled HTTP requests.",
+            "# TYPE ommatidia_requests_total counter",
+        ]
+        for labels, count in sorted(self.requests.items()):
+            lines.append(
+                f"ommatidia_requests_total{_labels(('method', 'handler', 'status'), labels)} {count}"
+            )
+
+        lines.extend(
+            _render_histograms(
+                "ommatidia_request_duration_seconds",
+                "The duration of HTTP requests.",
+                ("handler",),
+                self.request_durations,
+            )
+        )
+        lines.extend(
+            _render_histograms(
+                "ommatidia_stage_duration_seconds",
+                "The duration of the stages within a detection.",
+                ("stage", "detector"),
+                self.stage_durations,
+            )
+        )
+
+        lines.extend(
+            (
+                "# HELP ommatidia_queue_depth The number of pending detections.",
+                "# TYPE ommatidia_queue_depth gauge",
+                f"ommatidia_queue_depth {queue_depth}",
+                "# HELP ommatidia_detectors The number of running detector instances.",
+                "# TYPE ommatidia_detectors gauge",
+                f"ommatidia_detectors {instances}",
+            )
+        )
+
+        rss = _resident_memory()
+        if rss is not None:
+            lines.extend(
+                (
+                    "# HELP process_resident_memory_bytes Resident memory size of the server process in bytes.",
+                    "# TYPE process_resident_memory_bytes gauge",
+                    f"process_resident_memory_bytes {rss}",
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Count and time all the HTTP requests by the handling endpoint.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the endpoint within the scope
+            endpoint = scope.get("endpoint")
+            self.metrics.observe_request(
+                scope["method"],
+                endpoint.__name__ if endpoint is not None else "none",
+                status[0],
+                time.perf_counter() - start,
+            )
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+
+def _render_histograms(
+    name: str, description: str, label_names: Tuple[str, ...], histograms: Dict[Tuple[str, ...], Histogram]
+) -> List[str]:
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(histograms.items()):
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        for bound, count in zip(bounds, itertools.accumulate(histogram.buckets)):
+            lines.append(f"{name}_bucket{_labels(label_names + ('le',), labels + (bound,))} {count}")
+        lines.append(f"{name}_sum{_labels(label_names, labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(label_names, labels)} {histogram.count}")
+    return lines
+
+
+def _resident_memory() -> Optional[int]:
+    # The second field of statm is the number of resident pages, only available on Linux
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
@@ -1,8 +1,10 @@
 # coding: utf-8
 
+import base64
+from enum import Enum
 from typing import Optional, List
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, PrivateAttr, validator
 import numpy as np
 
 from .sample import Sample
@@ -25,25 +27,104 @@ class Annotation(BaseModel):
         assert value >= 0
         return value
 
+class MaskEncoding(str, Enum):
+    """
+    The representation of a mask sent to the client.
+
+    list: Each pupil pixel as separate annotation.
+    rle: Run-length encoding in column-major order as used by COCO, starting with the number of background pixels.
+    bitpacked: One bit per pixel in row-major order packed into bytes (MSB first) and encoded as Base64.
+    """
+
+    LIST = "list"
+    RLE = "rle"
+    BITPACKED = "bitpacked"
+
+class RunLengthEncoding(BaseModel):
+    """
+    A mask encoded as alternating runs of background and pupil pixels.
+    """
+
+    size: List[int] = Field(alias="size")
+    counts: List[int] = Field(alias="counts")
+
+class BitPacking(BaseModel):
+    """
+    A mask encoded as one bit per pixel.
+    """
+
+    size: List[int] = Field(alias="size")
+    data: str = Field(alias="data")
+
 class Mask(BaseModel):
     """
-    A mask annotating the pupil within a frame.
+    A mask annotating the pupil within a frame. Only the representation selected by the client is set.
     """
 
     type: str = Field("Mask", alias="type", const=True)
-    mask: List[Annotation] = Field(alias="mask")
+    mask: Optional[List[Annotation]] = Field(alias="mask", default=None)
+    rle: Optional[RunLengthEncoding] = Field(alias="rle", default=None)
+    bitpacked: Optional[BitPacking] = Field(alias="bitpacked", default=None)
     confidence: Optional[float] = Field(alias="confidence", default=None)
     sample: Optional[Sample] = Field(alias="sample", default=None)
-    
+
+    _pixels: Optional[np.ndarray] = PrivateAttr(default=None)
+
     @staticmethod
-    def from_numpy(mask: np.ndarray) -> "Mask":
+    def from_numpy(mask: np.ndarray, encoding: Optional[MaskEncoding] = None) -> "Mask":
+        """
+        Create a mask from a numpy array. Without an encoding, its representation is deferred until the server
+        encodes it as requested by the client.
         """
-        Create a mask from a numpy array.
+        result = Mask.construct(type="Mask")
+        result._pixels = mask != 0
+        return result if encoding is None else result.encode(encoding)
+
+    def encode(self, encoding: MaskEncoding) -> "Mask":
+        """
+        Represent the mask in the given encoding. Masks not created from an array are returned unchanged.
         """
-        x_values, y_values = np.where(mask != 0)
-        return Mask(
-            type="Mask", mask=[Annotation(x=x, y=y) for x, y in zip(x_values, y_values)]
+        pixels = self._pixels
+        if pixels is None:
+            return self
+
+        height, width = pixels.shape
+        if encoding == MaskEncoding.LIST:
+            x_values, y_values = np.where(pixels)
+            representation = {
+                "mask": [
+                    Annotation.construct(x=x, y=y)
+                    for x, y in zip(x_values.tolist(), y_values.tolist())
+                ]
+            }
+        elif encoding == MaskEncoding.RLE:
+            representation = {
+                "rle": RunLengthEncoding.construct(size=[height, width], counts=_run_lengths(pixels))
+            }
+        else:
+            data = base64.b64encode(np.packbits(pixels, axis=None).tobytes()).decode("ascii")
+            representation = {"bitpacked": BitPacking.construct(size=[height, width], data=data)}
+
+        result = Mask.construct(
+            type="Mask", confidence=self.confidence, sample=self.sample, **representation
         )
+        result._pixels = pixels
+        return result
+
+
+def _run_lengths(pixels: np.ndarray) -> List[int]:
+    """
+    Calculate the lengths of the alternating runs in column-major order, starting with background pixels.
+    """
+    flat = pixels.ravel(order="F")
+    if flat.size == 0:
+        return []
+
+    boundaries = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]))
+    counts = np.diff(boundaries).tolist()
+    if flat[0]:
+        counts.insert(0, 0)
+    return counts
 
 
 Mask.update_forward_refs()
@@ -0,0 +1,135 @@
+# coding: utf-8
+
+import collections
+import itertools
+import os
+import time
+from typing import Any, Callable, List, Optional
+
+
+class RegistryFullError(Exception):
+    """
+    The maximal number of detector instances is reached.
+    """
+
+    def __init__(self, max_instances: int):
+        super().__init__(f"The maximal number of {max_instances} detectors is reached")
+        self.max_instances = max_instances
+
+
+class DetectorRegistry:
+    """
+    The running detector instances by their identifier. Identifiers are never reused, so a client can not
+    accidentally access the instance of another one. Instances not used for a given time are evicted.
+    "on_remove" is called with the identifier and the instance whenever one is removed, the identifier is None
+    for instances rejected by "add".
+    """
+
+    def __init__(
+        self,
+        max_instances: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        on_remove: Optional[Callable[[Optional[int], Any], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_instances = max_instances
+        self.idle_timeout = idle_timeout
+        self._on_remove = on_remove
+        self._clock = clock
+        self._ids = itertools.count()
+
+        # Ordered by the last usage, the least recently used instance comes first
+        self._instances = collections.OrderedDict()
+
+    @staticmethod
+    def from_environment(on_remove: Optional[Callable[[Optional[int], Any], None]] = None) -> "DetectorRegistry":
+        """
+        Configure the registry using the environment variables of the container.
+        """
+        max_instances = os.environ.get("PUPIL_DETECTOR_MAX_INSTANCES")
+        idle_timeout = os.environ.get("PUPIL_DETECTOR_IDLE_TIMEOUT")
+        return DetectorRegistry(
+            max_instances=int(max_instances) if max_instances else None,
+            idle_timeout=float(idle_timeout) if idle_timeout else None,
+            on_remove=on_remove,
+        )
+
+    def __len__(self) -> int:
+        return len(self._instances)
+
+    def reserve(self) -> None:
+        """
+        Ensure there is space for another instance before creating it. Raises RegistryFullError otherwise.
+        """
+        self.evict_idle()
+        if self.max_instances is not None and len(self._instances) >= self.max_instances:
+            raise RegistryFullError(self.max_instances)
+
+    def add(self, instance: Any) -> int:
+        """
+        Register a new instance and return its identifier. If there is no space left, the instance is released
+        before RegistryFullError is raised.
+        """
+        try:
+            self.reserve()
+        except RegistryFullError:
+            # Concurrent creations may have taken the space reserved before creating the instance
+            self._release(None, instance)
+            raise
+        instance_id = next(self._ids)
+        self._instances[instance_id] = [instance, self._clock()]
+        return instance_id
+
+    def get(self, instance_id: int) -> Optional[Any]:
+        """
+        Query an instance and mark it as used. Returns None if it does not exist (anymore).
+        """
+        self.evict_idle()
+        entry = self._instances.get(instance_id)
+        if entry is None:
+            return None
+
+        entry[1] = self._clock()
+        self._instances.move_to_end(instance_id)
+        return entry[0]
+
+    def remove(self, instance_id: int) -> bool:
+        """
+        Remove an instance. Returns False if it does not exist (anymore).
+        """
+        entry = self._instances.pop(instance_id, None)
+        if entry is None:
+            return False
+
+        self._release(instance_id, entry[0])
+        return True
+
+    def ids(self) -> List[int]:
+        """
+        List the identifiers of all running instances in the order of their creation.
+        """
+        self.evict_idle()
+        return sorted(self._instances.keys())
+
+    def evict_idle(self) -> int:
+        """
+        Remove all the instances not used within the idle timeout and return their number.
+        """
+        if self.idle_timeout is None:
+            return 0
+
+        deadline = self._clock() - self.idle_timeout
+        evicted = 0
+        while len(self._instances) > 0:
+            instance_id, (instance, last_used) = next(iter(self._instances.items()))
+            if last_used > deadline:
+                break
+
+            del self._instances[instance_id]
+            self._release(instance_id, instance)
+            evicted += 1
+        return evicted
+
+    def _release(self, instance_id: Optional[int], instance: Any) -> None:
+        if self._on_remove is not None:
+            self._on_remove(instance_id, instance)
@@ -2,12 +2,15 @@ import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
-from pupil_detector.main import app as application
+from pupil_detector.main import app as application, release_detector
+from pupil_detector.registry import DetectorRegistry
 
 
 @pytest.fixture
 def app() -> FastAPI:
     application.dependency_overrides = {}
+    # Each test starts without running detectors
+    application.state.detectors = DetectorRegistry(on_remove=release_detector)
     return application
 
 
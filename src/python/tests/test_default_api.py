@@ -1,7 +1,23 @@
 # coding: utf-8
 
+import time
+
+import cv2 as cv
+import numpy as np
+
 from fastapi.testclient import TestClient
 from pupil_detector.detector import Config
+from pupil_detector.executor import DetectionExecutor
+from pupil_detector.main import release_detector
+from pupil_detector.registry import DetectorRegistry
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
 
 
 def test_config_get(client: TestClient):
@@ -28,3 +44,98 @@ def test_root_get(client: TestClient):
 
     response = client.request("GET", "/")
     assert response.status_code == 200
+
+
+def test_ready_get(app):
+    """Test case for ready_get
+
+    Report the readiness once the warm-up at startup is finished
+    """
+
+    # The executor is shut down with the application
+    executor = app.state.executor
+    app.state.executor = DetectionExecutor()
+    app.state.ready = False
+    try:
+        with TestClient(app) as client:
+            for _ in range(100):
+                response = client.request("GET", "/ready/")
+                if response.status_code == 200:
+                    break
+                assert response.status_code == 503
+                time.sleep(0.05)
+    finally:
+        app.state.executor = executor
+
+    assert response.status_code == 200
+
+
+class _FailingExecutor(DetectionExecutor):
+    async def warm_up(self, config: Config) -> None:
+        raise RuntimeError("The model is missing")
+
+
+def test_ready_get_failed_warm_up(app):
+    """Test case for ready_get
+
+    Report the failure of the warm-up instead of the readiness
+    """
+
+    executor = app.state.executor
+    app.state.executor = _FailingExecutor()
+    app.state.ready = False
+    try:
+        with TestClient(app) as client:
+            for _ in range(100):
+                response = client.request("GET", "/ready/")
+                assert response.status_code == 503
+                if "failed" in response.json():
+                    break
+                time.sleep(0.05)
+    finally:
+        app.state.executor = executor
+        app.state.warm_up_error = None
+
+    assert response.json() == "The warm-up failed: The model is missing"
+    assert not app.state.ready
+
+
+def test_metrics_get(client: TestClient):
+    """Test case for metrics_get
+
+    Expose the request counters and the durations of the detection stages
+    """
+
+    detector_id = int(client.request("POST", "/detections/").json())
+    sample = cv.imencode(".png", np.full((21, 31), fill_value=42, dtype=np.uint8))
+    assert client.request("POST", f"/detections/{detector_id}/", data=sample[1].tobytes()).status_code == 200
+
+    response = client.request("GET", "/metrics/")
+    assert response.status_code == 200
+
+    metrics = response.text.splitlines()
+    requests = 'ommatidia_requests_total{method="POST",handler="detect",status="200"}'
+    assert any(line.startswith(requests) for line in metrics)
+    for stage in ("read", "decode", "infer", "serialize"):
+        assert f'ommatidia_stage_duration_seconds_count{{stage="{stage}",detector="{detector_id}"}} 1' in metrics
+    assert "ommatidia_queue_depth 0" in metrics
+
+    # The durations of removed detectors are dropped
+    assert client.request("DELETE", f"/detections/{detector_id}/").status_code == 200
+    metrics = client.request("GET", "/metrics").text.splitlines()
+    assert not any(f'detector="{detector_id}"' in line for line in metrics)
+
+
+def test_metrics_get_idle_detectors(app, client: TestClient):
+    """Test case for metrics_get
+
+    Count only the detectors not evicted due to the idle timeout
+    """
+
+    clock = _Clock()
+    app.state.detectors = DetectorRegistry(idle_timeout=10, on_remove=release_detector, clock=clock)
+    assert client.request("POST", "/detections/").status_code == 200
+    assert "ommatidia_detectors 1" in client.request("GET", "/metrics/").text.splitlines()
+
+    clock.now = 20
+    assert "ommatidia_detectors 0" in client.request("GET", "/metrics/").text.splitlines()
@@ -1,9 +1,17 @@
 # coding: utf-8
 
+import json
+
 from fastapi.testclient import TestClient
 import cv2 as cv
 import numpy as np
 
+from pupil_detector.detector import Detector
+from pupil_detector.encoding import MEDIA_TYPE_BINARY, PREDICTION
+from pupil_detector.executor import DetectionExecutor
+from pupil_detector.frames import join_frames
+from pupil_detector.models.point import Point
+
 
 def test_create(client: TestClient):
     """
@@ -108,6 +116,64 @@ def test_detect(client: TestClient):
     assert isinstance(response["y"], int)
 
 
+def test_detect_batch(client: TestClient):
+    """
+    Evaluate multiple samples within a single request.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+
+    # Send samples of different sizes to the detector
+    samples = []
+    for shape in ((21, 31), (40, 30), (21, 31)):
+        encoded = cv.imencode(".png", np.full(shape, fill_value=42, dtype=np.uint8))
+        assert encoded[0], "Encoding failed"
+        samples.append(encoded[1].tobytes())
+
+    created_id = int(creation_response.json())
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/batch/",
+        data=join_frames(samples),
+    )
+
+    assert response.status_code == 200
+    response = response.json()
+    assert len(response) == 3
+    assert [(entry["sample"]["width"], entry["sample"]["height"]) for entry in response] == [
+        (31, 21),
+        (30, 40),
+        (31, 21),
+    ]
+
+
+def test_detect_batch_invalid(client: TestClient):
+    """
+    Evaluate a sequence containing a truncated sample.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+
+    created_id = int(creation_response.json())
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/batch/",
+        data=join_frames([b"This is not an image"])[:-4],
+    )
+
+    assert response.status_code == 400
+
+
 def test_delete(client: TestClient):
     """Test case for detections_detection_id_delete
 
@@ -165,3 +231,359 @@ def test_query_detections(client: TestClient):
 
     # The old IDs may remain in the list. Check only for the two most recent ones
     assert creation_response.json()[-2:] == [created_id_1, created_id_2]
+
+
+def test_detect_busy(app, client: TestClient):
+    """
+    Reject samples with a hint for retrying if the detector is busy.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    # Do not allow any pending request
+    executor = app.state.executor
+    app.state.executor = DetectionExecutor(queue_size=0, retry_after=3)
+    try:
+        sample = cv.imencode(".png", np.full((21, 31), fill_value=42, dtype=np.uint8))
+        response = client.request(
+            "POST",
+            f"/detections/{created_id}/",
+            data=sample[1].tobytes(),
+        )
+    finally:
+        app.state.executor.shutdown()
+        app.state.executor = executor
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+
+
+def test_detect_process_executor(app, client: TestClient):
+    """
+    Evaluate samples on detectors living in worker processes.
+    """
+
+    executor = app.state.executor
+    app.state.executor = DetectionExecutor(kind="process", workers=1)
+    try:
+        creation_response = client.request(
+            "POST",
+            "/detections/",
+        )
+        assert creation_response.status_code == 200
+        created_id = int(creation_response.json())
+
+        sample = cv.imencode(".png", np.full((21, 31), fill_value=42, dtype=np.uint8))
+        response = client.request(
+            "POST",
+            f"/detections/{created_id}/",
+            data=sample[1].tobytes(),
+        )
+        invalid_response = client.request(
+            "POST",
+            f"/detections/{created_id}/",
+            data=b"This is not an image",
+        )
+    finally:
+        app.state.executor.shutdown()
+        app.state.executor = executor
+
+    assert response.status_code == 200
+    assert response.json()["sample"] == {"width": 31, "height": 21}
+    assert invalid_response.status_code == 400
+
+
+def test_detect_stream(client: TestClient):
+    """
+    Evaluate a stream of samples and receive the predictions in order.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    sample = cv.imencode(".png", np.full((21, 31), fill_value=42, dtype=np.uint8))[1].tobytes()
+    stream = join_frames([sample, b"This is not an image", sample, sample])
+
+    # The last sample is truncated
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/stream/?depth=2",
+        data=stream[:-4],
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    entries = [json.loads(line) for line in response.text.splitlines()]
+    assert [entry["frame"] for entry in entries] == [0, 1, 2, 3]
+    assert entries[0]["prediction"]["sample"] == {"width": 31, "height": 21}
+    assert "error" in entries[1]
+    assert entries[2]["prediction"]["sample"] == {"width": 31, "height": 21}
+    assert "error" in entries[3]
+
+
+def test_detect_stream_failing_detector(client: TestClient, monkeypatch):
+    """
+    Continue the stream if the detector fails on a single sample.
+    """
+
+    def detect(self, frame: np.ndarray) -> Point:
+        if frame[0, 0] == 13:
+            raise ValueError("Degenerate frame")
+        return Point(x=0, y=0)
+
+    monkeypatch.setattr(Detector, "detect", detect)
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    samples = [
+        cv.imencode(".png", np.full((21, 31), fill_value=value, dtype=np.uint8))[1].tobytes()
+        for value in (42, 13, 42)
+    ]
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/stream/",
+        data=join_frames(samples),
+    )
+
+    assert response.status_code == 200
+    entries = [json.loads(line) for line in response.text.splitlines()]
+    assert [entry["frame"] for entry in entries] == [0, 1, 2]
+    assert "prediction" in entries[0]
+    assert "error" in entries[1] and "prediction" not in entries[1]
+    assert "prediction" in entries[2]
+
+
+def test_detect_raw(client: TestClient):
+    """
+    Evaluate a sample given as raw grayscale pixels.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    sample = np.full((21, 31), fill_value=42, dtype=np.uint8)
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/?width=31&height=21",
+        data=sample.tobytes(),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    assert response.json()["sample"] == {"width": 31, "height": 21}
+
+    # The dimensions do not match the data
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/?width=30&height=21",
+        data=sample.tobytes(),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 400
+
+    # The dimensions are missing
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/",
+        data=sample.tobytes(),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 400
+
+    # Parameters of the media type are ignored
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/",
+        data=sample.tobytes(),
+        headers={"Content-Type": "Application/Octet-Stream; charset=binary"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "The dimensions of raw samples must be specified"
+
+
+def test_detect_raw_writable(client: TestClient, monkeypatch):
+    """
+    Detectors modifying their frames in place receive writable copies of raw samples.
+    """
+
+    def detect(self, frame: np.ndarray) -> Point:
+        frame[0, 0] = 0
+        return Point(x=0, y=0)
+
+    monkeypatch.setattr(Detector, "detect", detect)
+    monkeypatch.setattr(Detector, "writable_frames", True)
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    sample = np.full((21, 31), fill_value=42, dtype=np.uint8)
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/?width=31&height=21",
+        data=sample.tobytes(),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+
+
+def test_detect_batch_raw(client: TestClient):
+    """
+    Evaluate multiple samples given as raw grayscale pixels.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    samples = [np.full((21, 31), fill_value=value, dtype=np.uint8).tobytes() for value in (0, 42)]
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/batch/?width=31&height=21",
+        data=join_frames(samples),
+    )
+
+    assert response.status_code == 200
+    assert [entry["sample"] for entry in response.json()] == [{"width": 31, "height": 21}] * 2
+
+
+def test_detect_binary(client: TestClient):
+    """
+    Receive the predictions in the compact binary layout.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    sample = cv.imencode(".png", np.full((21, 31), fill_value=42, dtype=np.uint8))[1].tobytes()
+    json_response = client.request("POST", f"/detections/{created_id}/", data=sample).json()
+
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/",
+        data=sample,
+        headers={"Accept": MEDIA_TYPE_BINARY},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == MEDIA_TYPE_BINARY
+    x, y, _, _, _, _, width, height = PREDICTION.unpack(response.content)
+    assert (x, y, width, height) == (json_response["x"], json_response["y"], 31, 21)
+
+    # Batches are encoded as contiguous records
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/batch/",
+        data=join_frames([sample, sample, sample]),
+        headers={"Accept": MEDIA_TYPE_BINARY},
+    )
+    assert response.status_code == 200
+    records = list(PREDICTION.iter_unpack(response.content))
+    assert len(records) == 3
+    assert all(record[6:] == (31, 21) for record in records)
+
+    # The preferences of the client are respected
+    for accept, expected in (
+        (f"{MEDIA_TYPE_BINARY}, application/json;q=0.5", MEDIA_TYPE_BINARY),
+        (f"application/json, {MEDIA_TYPE_BINARY};q=0.5", "application/json"),
+        (f"{MEDIA_TYPE_BINARY};q=0", "application/json"),
+        (f"{MEDIA_TYPE_BINARY};q=0.0, */*", "application/json"),
+        ("application/*", "application/json"),
+    ):
+        response = client.request("POST", f"/detections/{created_id}/", data=sample, headers={"Accept": accept})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == expected
+
+
+def test_detect_binary_mask(client: TestClient, monkeypatch):
+    """
+    Masks can not be encoded in the binary layout and are sent as JSON if the client accepts it.
+    """
+
+    metadata = Detector.metadata().copy(update={"prediction": "Mask"})
+    monkeypatch.setattr(Detector, "metadata", classmethod(lambda cls: metadata))
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    sample = cv.imencode(".png", np.full((21, 31), fill_value=42, dtype=np.uint8))[1].tobytes()
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/",
+        data=sample,
+        headers={"Accept": f"{MEDIA_TYPE_BINARY}, application/json"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/",
+        data=sample,
+        headers={"Accept": MEDIA_TYPE_BINARY},
+    )
+    assert response.status_code == 406
+
+
+def test_detect_server_timing(client: TestClient):
+    """
+    Report the durations of the stages of a detection.
+    """
+
+    # Create detector
+    creation_response = client.request(
+        "POST",
+        "/detections/",
+    )
+    assert creation_response.status_code == 200
+    created_id = int(creation_response.json())
+
+    sample = cv.imencode(".png", np.full((21, 31), fill_value=42, dtype=np.uint8))
+    response = client.request(
+        "POST",
+        f"/detections/{created_id}/",
+        data=sample[1].tobytes(),
+    )
+    assert response.status_code == 200
+
+    stages = [entry.strip().split(";") for entry in response.headers["Server-Timing"].split(",")]
+    assert [name for name, _ in stages] == ["read", "decode", "infer", "serialize"]
+    assert all(duration.startswith("dur=") and float(duration[4:]) >= 0 for _, duration in stages)
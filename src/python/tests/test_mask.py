@@ -0,0 +1,63 @@
+# coding: utf-8
+
+import base64
+
+import numpy as np
+
+from pupil_detector.models.mask import Mask, MaskEncoding
+
+
+def _example() -> np.ndarray:
+    mask = np.zeros((4, 5), dtype=np.uint8)
+    mask[1:3, 2:4] = 255
+    mask[0, 0] = 1
+    return mask
+
+
+def test_mask_list():
+    """
+    The list encoding annotates each pupil pixel separately.
+    """
+
+    mask = Mask.from_numpy(_example(), MaskEncoding.LIST).dict()
+    assert mask["rle"] is None and mask["bitpacked"] is None
+    assert len(mask["mask"]) == 5
+
+
+def test_mask_rle():
+    """
+    The run-length encoding alternates between background and pupil in column-major order.
+    """
+
+    example = _example()
+    rle = Mask.from_numpy(example, MaskEncoding.RLE).dict()["rle"]
+    assert rle["size"] == [4, 5]
+    assert rle["counts"] == [0, 1, 8, 2, 2, 2, 5]
+
+    decoded = np.repeat(np.arange(len(rle["counts"])) % 2, rle["counts"]).reshape((5, 4)).T
+    assert np.array_equal(decoded != 0, example != 0)
+
+
+def test_mask_bitpacked():
+    """
+    The bitpacked encoding stores one bit per pixel in row-major order.
+    """
+
+    example = _example()
+    bitpacked = Mask.from_numpy(example, MaskEncoding.BITPACKED).dict()["bitpacked"]
+    assert bitpacked["size"] == [4, 5]
+
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(bitpacked["data"]), dtype=np.uint8))
+    assert np.array_equal(bits[: example.size].reshape(example.shape) != 0, example != 0)
+
+
+def test_mask_reencode():
+    """
+    A mask may be represented differently after its creation.
+    """
+
+    mask = Mask.from_numpy(_example())
+    mask.confidence = 0.5
+    encoded = mask.encode(MaskEncoding.RLE)
+    assert encoded.mask is None and encoded.rle is not None
+    assert encoded.confidence == 0.5
@@ -0,0 +1,67 @@
+# coding: utf-8
+
+import pytest
+
+from pupil_detector.registry import DetectorRegistry, RegistryFullError
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_registry_ids():
+    """
+    Identifiers are not reused after an instance was removed.
+    """
+
+    released = []
+    registry = DetectorRegistry(on_remove=lambda _, instance: released.append(instance))
+    first, second = registry.add("a"), registry.add("b")
+    assert registry.remove(first)
+    assert not registry.remove(first)
+    assert registry.add("c") not in (first, second)
+    assert registry.get(first) is None
+    assert registry.get(second) == "b"
+    assert released == ["a"]
+
+
+def test_registry_max_instances():
+    """
+    The number of instances is limited.
+    """
+
+    released = []
+    registry = DetectorRegistry(max_instances=1, on_remove=lambda _, instance: released.append(instance))
+    registry.add("a")
+    with pytest.raises(RegistryFullError):
+        registry.add("b")
+
+    # The rejected instance is released
+    assert released == ["b"]
+
+
+def test_registry_idle_timeout():
+    """
+    Instances not used within the timeout are evicted, starting with the least recently used one.
+    """
+
+    clock = _Clock()
+    released = []
+    registry = DetectorRegistry(idle_timeout=10, on_remove=lambda _, instance: released.append(instance), clock=clock)
+    first, second = registry.add("a"), registry.add("b")
+
+    clock.now = 8
+    assert registry.get(first) == "a"
+    clock.now = 12
+    assert registry.ids() == [first]
+    assert registry.get(second) is None
+    assert released == ["b"]
+
+    clock.now = 30
+    assert len(registry) == 1
+    assert registry.get(first) is None
+    assert released == ["b", "a"]
@@ -1,16 +1,28 @@
 import argparse
 import logging
 from pathlib import Path
-from dataclasses import dataclass, field, InitVar
-from typing import Sequence, Tuple, Optional, List
-import csv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Tuple, Optional, List, Set
 import sys
 import os
-
-from .docker import Image, Container, InvalidContainerException
+import threading
+
+from .discovery import ImageFolder
+from .docker import Image, Container, InvalidContainerException, Response
+from .evaluator import AsyncEvaluator
+from .export import OrderedWriter, ResultSink, open_sink
+from .frames import FrameBroadcast, read_frames
+from .pool import DEFAULT_STATE_FILE, ContainerPool
+from .store import ResultStore, hash_config
 from .test_runner import TestRunner
 
 
+# The configuration the detectors are evaluated with
+DETECTOR_CONFIG = {}
+
+
 @dataclass
 class DetectorHandler:
     """
@@ -20,72 +32,121 @@ class DetectorHandler:
     detector_dir_or_image: str
     show_output: bool
     ignore_cache: bool
+    jobs: int
+    pool: Optional[ContainerPool]
 
-    def run(self) -> bool:
+    def run(self, detector_dir_or_image: Optional[str] = None) -> bool:
         """
         Run a single detector.
         """
 
+        if detector_dir_or_image is None:
+            detector_dir_or_image = self.detector_dir_or_image
+
         # If there is a colon, treat it as image
-        if self.is_image:
-            return self._spawn_container(self.detector_dir_or_image)
+        if DetectorHandler._is_image(detector_dir_or_image):
+            return self._spawn_containers(detector_dir_or_image)
 
         logging.info(
             "Building the image at '%s' (show output: %s)... ",
-            str(self.detector_dir_or_image),
+            str(detector_dir_or_image),
             self.show_output,
         )
         try:
             with Image(
-                Path(self.detector_dir_or_image), ignore_cache=self.ignore_cache
+                Path(detector_dir_or_image), ignore_cache=self.ignore_cache
             ) as image:
-                return self._spawn_container(image.name_and_tag)
+                return self._spawn_containers(image.name_and_tag)
         except InvalidContainerException as ex:
             logging.warning(str(ex))
             return False
 
-    def _spawn_container(self, name_and_tag: str) -> bool:
-        logging.info("Spawning the container '%s' ...", name_and_tag)
-        with Container(name_and_tag, self.show_output) as container:
-            # Start the detector
-            while not container.is_ready(3):
-                logging.info("Waiting for detector not get ready ...")
+    def _spawn_containers(self, name_and_tag: str) -> bool:
+        containers = (
+            self.pool.acquire(name_and_tag, self.replicas, in_flight=self.in_flight)
+            if self.pool is not None
+            else None
+        )
+        if containers is not None:
+            logging.info(
+                "Reusing %d pooled container(s) of '%s' ...", self.replicas, name_and_tag
+            )
+        else:
+            logging.info(
+                "Spawning %d container(s) of '%s' ...", self.replicas, name_and_tag
+            )
+            containers = [
+                Container(name_and_tag, self.show_output, in_flight=self.in_flight)
+                for _ in range(self.replicas)
+            ]
+
+        with ExitStack() as stack:
+            for container in containers:
+                stack.enter_context(container)
+
+            # The containers start concurrently, so waiting for one after another is fine
+            for container in containers:
+                container.wait_until_ready()
             logging.info("Detector sucessfully started")
 
-            return self._run_detector(name_and_tag, container)
+            return self._run_detector(name_and_tag, containers)
 
     def run_all(self) -> bool:
         """
-        Run all detectors within a directory.
+        Run all detectors within a directory. Up to "jobs" of them are built and evaluated concurrently.
         """
 
+        # Run the detectors. However, we do not stop early on error!
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as executor:
+            results = list(executor.map(self._run_logged, self._detector_dirs()))
+        return all(results)
+
+    def _detector_dirs(self) -> List[str]:
         if self.is_image:
             raise ValueError("Specifying multiple images is not supported")
 
-        all_valid = True
-        for entry in Path(self.detector_dir_or_image).glob("*/Dockerfile"):
-            # Run the detector. However, we do not stop early on error!
-            self.detector_dir_or_image = str(entry.parent)
-            if not self.run():
-                all_valid = False
-            logging.info("Testing detector done\n")
+        return [
+            str(entry.parent)
+            for entry in Path(self.detector_dir_or_image).glob("*/Dockerfile")
+        ]
 
-        return all_valid
+    def _run_logged(self, detector_dir: str) -> bool:
+        result = self.run(detector_dir)
+        logging.info("Testing detector '%s' done\n", detector_dir)
+        return result
 
-    def _run_detector(self, _name_and_tag: str, _c: Container) -> bool:
+    def _run_detector(self, _name_and_tag: str, _c: List[Container]) -> bool:
         raise NotImplementedError("Not implemented by subclass")
 
+    @property
+    def replicas(self) -> int:
+        """
+        The number of containers spawned per detector.
+        """
+        return 1
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of concurrent requests per container.
+        """
+        return 1
+
     @property
     def is_image(self):
+        return DetectorHandler._is_image(self.detector_dir_or_image)
+
+    @staticmethod
+    def _is_image(detector_dir_or_image: str) -> bool:
         # It is more complex on Windows due to the "C:"
         if os.name == "nt":
             truncated_value = (
-                self.detector_dir_or_image
-                if len(self.detector_dir_or_image) <= 2
-                else self.detector_dir_or_image[2:]
+                detector_dir_or_image
+                if len(detector_dir_or_image) <= 2
+                else detector_dir_or_image[2:]
             )
             return ":" in truncated_value
-        return ":" in self.detector_dir_or_image
+        return ":" in detector_dir_or_image
 
 
 class TestDetector(DetectorHandler):
@@ -93,14 +154,20 @@ class TestDetector(DetectorHandler):
     Evaluate unit tests on the detector.
     """
 
-    def _run_detector(self, _: str, container: Container) -> bool:
+    def _run_detector(self, _: str, containers: List[Container]) -> bool:
         # Run all the tests
+        (container,) = containers
+        existing_detectors = TestDetector._list_detectors(container)
         test_runner = TestRunner(container)
         logging.info("Found %d tests for the detector", len(test_runner))
         for result in test_runner:
             if not result:
                 logging.warning(str(result))
 
+        # Pooled containers are reused, so remove the detectors created by the tests
+        for detector_id in TestDetector._list_detectors(container) - existing_detectors:
+            container.request(f"/detections/{detector_id}/", method="DELETE")
+
         if test_runner:
             logging.info("All tests done without any error")
             return True
@@ -115,6 +182,37 @@ class TestDetector(DetectorHandler):
         logging.info(f"Some tests failed; you can check the logs with 'docker logs {container.container_id}'")
         return False
 
+    @staticmethod
+    def _list_detectors(container: Container) -> Set[int]:
+        response = container.request("/detections/")
+        if response.status != 200:
+            return set()
+        try:
+            return set(response.json)
+        except (ValueError, TypeError):
+            return set()
+
+
+@dataclass
+class StartPool(DetectorHandler):
+    """
+    Start the containers of the detector within the pool.
+    """
+
+    replicas: int = 1
+
+    def _spawn_containers(self, name_and_tag: str) -> bool:
+        try:
+            entries = self.pool.up(name_and_tag, self.replicas)
+        except InvalidContainerException as ex:
+            logging.warning(str(ex))
+            return False
+
+        logging.info(
+            "The pool holds %d container(s) of '%s'", len(entries), name_and_tag
+        )
+        return True
+
 
 @dataclass
 class EvaluateDetector(DetectorHandler):
@@ -122,65 +220,121 @@ class EvaluateDetector(DetectorHandler):
     Evaluate the detector on images.
     """
 
-    image_folder: InitVar[Path]
-    _files: Sequence[Path] = field(init=False)
-    _results: List[
-        Tuple[str, str, Optional[float], Optional[float], Optional[float]]
-    ] = field(init=False)
+    images: ImageFolder
+
+    sink: Optional[ResultSink] = None
+    replicas: int = 1
+    window: int = 1
+    store: Optional[ResultStore] = None
+    sweep: bool = False
+    sweep_buffer: int = 64
+    _local: threading.local = field(init=False, default_factory=threading.local)
 
-    def __post_init__(self, image_folder: Path):
-        self._files = list(image_folder.rglob("*.png"))
-        self._results = []
+    def run_all(self) -> bool:
+        """
+        Run all detectors within a directory. In sweep mode, all of them are evaluated at once and each image is
+        read only once for all of them.
+        """
+        if not self.sweep:
+            return super().run_all()
+
+        detector_dirs = self._detector_dirs()
+        broadcast = FrameBroadcast(
+            read_frames(self.images), len(detector_dirs), capacity=self.sweep_buffer
+        )
+
+        def run_subscribed(consumer: int) -> bool:
+            self._local.frames = broadcast.subscribe(consumer)
+            try:
+                return self._run_logged(detector_dirs[consumer])
+            finally:
+                broadcast.close(consumer)
+
+        # The detectors consume the frames in lockstep, so all of them must run concurrently
+        with ThreadPoolExecutor(max_workers=max(len(detector_dirs), 1)) as executor:
+            results = list(executor.map(run_subscribed, range(len(detector_dirs))))
+        return all(results)
+
+    def _run_detector(self, name_and_tag: str, containers: List[Container]) -> bool:
+        # Results of earlier runs are identified by the image content, the detector, and its configuration
+        detector_digest = Image.digest(name_and_tag) if self.store is not None else ""
+        config_hash = hash_config(DETECTOR_CONFIG)
+        writer = OrderedWriter(self.sink)
+
+        def skip(index: int, image_path: Path, image_hash: str) -> bool:
+            stored = self._stored_row(
+                name_and_tag, image_path, (image_hash, detector_digest, config_hash)
+            )
+            if stored is None:
+                return False
+            writer.complete(index, stored)
+            return True
 
-    def _run_detector(self, name_and_tag: str, container: Container) -> bool:
-        # Create the detector
-        creation_response = container.request("/detections/", method="POST", body={})
-        if creation_response.status != 200:
+        def on_result(
+            index: int, image_path: Path, image_hash: str, raw_result: Response, duration: float
+        ):
+            row = EvaluateDetector._result_row(
+                name_and_tag, image_path, raw_result, duration
+            )
+            if row is not None and self.store is not None:
+                self.store.add((image_hash, detector_digest, config_hash), list(row))
+            writer.complete(index, row)
+
+        # Distribute the images across the replicas and evaluate them concurrently
+        frames = getattr(self._local, "frames", None)
+        evaluator = AsyncEvaluator(
+            containers,
+            frames if frames is not None else read_frames(self.images),
+            window=self.window,
+            config=DETECTOR_CONFIG,
+        )
+        if not evaluator.run(on_result, skip):
             logging.warning("Unable to create detector")
             return False
-        detector_path = f"/detections/{creation_response.body}/"
-
-        for image_path in self._files:
-            with image_path.open("rb") as image_file:
-                raw_result = container.request(
-                    detector_path,
-                    method="POST",
-                    body=image_file.read(),
-                    content_type="image/png",
-                )
-                if raw_result.status != 200:
-                    logging.warning(
-                        "Detector '%s' failed (code: %s) on '%s': '%s'",
-                        name_and_tag,
-                        raw_result.status,
-                        image_path.name,
-                        raw_result.body,
-                    )
-                    continue
-
-                result = raw_result.json
-                self._results.append(
-                    (
-                        name_and_tag,
-                        image_path.name,
-                        result["x"],
-                        result["y"],
-                        result["confidence"] if "confidence" in result else None,
-                    )
-                )
-
         return True
 
-    def export(self, file_path: Path) -> None:
-        """
-        Export generated annotations as files.
-        """
-        with file_path.open("w", newline="") as file:
-            writer = csv.writer(
-                file, delimiter="\t", quotechar='"', quoting=csv.QUOTE_MINIMAL
+    @property
+    def in_flight(self) -> int:
+        return self.window
+
+    def _stored_row(
+        self, name_and_tag: str, image_path: Path, key: Tuple[str, str, str]
+    ) -> Optional[Tuple]:
+        stored = self.store.get(key) if self.store is not None else None
+        if stored is None:
+            return None
+
+        # The file may have been renamed in the meantime
+        return (name_and_tag, image_path.name, *stored[2:])
+
+    @staticmethod
+    def _result_row(
+        name_and_tag: str, image_path: Path, raw_result: Response, duration: float
+    ) -> Optional[Tuple]:
+        if raw_result.status != 200:
+            logging.warning(
+                "Detector '%s' failed (code: %s) on '%s': '%s'",
+                name_and_tag,
+                raw_result.status,
+                image_path.name,
+                raw_result.body,
             )
-            writer.writerow(("Detector", "File", "X", "Y", "Confidence"))
-            writer.writerows(self._results)
+            return None
+
+        # Separate the costs of the algorithm from the transport, if reported by the detector
+        result = raw_result.prediction
+        timings = raw_result.server_timing
+        return (
+            name_and_tag,
+            image_path.name,
+            result["x"],
+            result["y"],
+            result.get("confidence"),
+            duration,
+            timings.get("decode"),
+            timings.get("infer"),
+            timings.get("serialize"),
+        )
 
 
 def parse_arguments() -> int:
@@ -190,6 +344,7 @@ def parse_arguments() -> int:
 
     MODE_UNIT_TEST = "unit"
     MODE_EVALUATION = "eval"
+    MODE_POOL = "pool"
 
     logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
 
@@ -219,6 +374,19 @@ def parse_arguments() -> int:
         action="store_true",
         help="ignore existing caches",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="the number of detectors built and evaluated concurrently",
+    )
+    parser.add_argument(
+        "--pool",
+        type=str,
+        default=str(DEFAULT_STATE_FILE),
+        help="the state file of the container pool; running containers tracked there are reused",
+    )
 
     commands = parser.add_subparsers(dest="subcommand")
     commands.required = True
@@ -237,32 +405,159 @@ def parse_arguments() -> int:
     evaluation_parser.add_argument(
         "output_file",
         type=str,
-        help="the location the output TSV is written to",
+        help="the location the results are streamed to; a numpy array if ending on '.npy', TSV otherwise",
+    )
+    evaluation_parser.add_argument(
+        "-r",
+        "--replicas",
+        type=int,
+        default=1,
+        help="the number of containers per detector the images are distributed across",
+    )
+    evaluation_parser.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        default=1,
+        help="the number of outstanding requests per container; the durations include the queuing if larger than 1",
+    )
+    evaluation_parser.add_argument(
+        "-s",
+        "--store",
+        type=str,
+        default=None,
+        help="a file the results are appended to as they arrive; images already evaluated there are skipped",
+    )
+    evaluation_parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        default=None,
+        help="a file listing the images found, which is read instead of scanning the directory again",
+    )
+    evaluation_parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="scan the directory for images again and replace the manifest",
+    )
+    evaluation_parser.add_argument(
+        "--scan_workers",
+        type=int,
+        default=1,
+        help="the number of directories listed concurrently while scanning for images",
+    )
+    evaluation_parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="evaluate all detectors at once, reading each image only once for all of them",
+    )
+    evaluation_parser.add_argument(
+        "--sweep_buffer",
+        type=int,
+        default=64,
+        help="the number of images held in memory for detectors lagging behind in sweep mode",
+    )
+    pool_parser = commands.add_parser(
+        MODE_POOL, help="Keep containers of the detector(s) running for subsequent runs"
+    )
+    pool_parser.add_argument(
+        "action",
+        choices=("up", "down", "status"),
+        help="start or update the containers, stop them, or list all of them",
+    )
+    pool_parser.add_argument(
+        "-r",
+        "--replicas",
+        type=int,
+        default=1,
+        help="the number of containers per detector",
     )
 
     args = parser.parse_args()
+    pool = ContainerPool(Path(args.pool))
+    if args.subcommand == MODE_POOL:
+        return run_pool(args, pool)
+
     if args.subcommand == MODE_UNIT_TEST:
         tests = TestDetector(
             args.directory_or_image,
             show_output=args.output,
             ignore_cache=args.ignore_cache,
+            jobs=args.jobs,
+            pool=pool,
         )
         all_tests_valid = tests.run_all() if args.test_all else tests.run()
         return 0 if all_tests_valid else 1
 
-    evaluation = EvaluateDetector(
+    with ExitStack() as stack:
+        store = (
+            stack.enter_context(ResultStore(Path(args.store)))
+            if args.store is not None
+            else None
+        )
+        sink = stack.enter_context(open_sink(Path(args.output_file)))
+        evaluation = EvaluateDetector(
+            args.directory_or_image,
+            show_output=args.output,
+            ignore_cache=args.ignore_cache,
+            jobs=args.jobs,
+            pool=pool,
+            images=ImageFolder(
+                Path(args.image_directory),
+                manifest=Path(args.manifest) if args.manifest is not None else None,
+                workers=args.scan_workers,
+                rescan=args.rescan,
+            ),
+            sink=sink,
+            replicas=max(args.replicas, 1),
+            window=max(args.window, 1),
+            sweep=args.sweep,
+            sweep_buffer=args.sweep_buffer,
+            store=store,
+        )
+
+        if args.test_all:
+            evaluation.run_all()
+        else:
+            evaluation.run()
+    return 0
+
+
+def run_pool(args: argparse.Namespace, pool: ContainerPool) -> int:
+    """
+    Manage the containers within the pool.
+    """
+
+    if args.action == "status":
+        for entry in pool.entries():
+            logging.info(
+                "'%s': container %s at port %d", entry["image"], entry["id"][:12], entry["port"]
+            )
+        return 0
+
+    if args.action == "down":
+        if args.test_all:
+            stopped = pool.down()
+        else:
+            name_and_tag = (
+                args.directory_or_image
+                if DetectorHandler._is_image(args.directory_or_image)
+                else Image._create_name_and_tag(Path(args.directory_or_image))
+            )
+            stopped = pool.down(name_and_tag)
+        logging.info("Stopped %d container(s)", stopped)
+        return 0
+
+    handler = StartPool(
         args.directory_or_image,
         show_output=args.output,
         ignore_cache=args.ignore_cache,
-        image_folder=Path(args.image_directory),
+        jobs=args.jobs,
+        pool=pool,
+        replicas=max(args.replicas, 1),
     )
-
-    if args.test_all:
-        evaluation.run_all()
-    else:
-        evaluation.run()
-    evaluation.export(Path(args.output_file))
-    return 0
+    all_started = handler.run_all() if args.test_all else handler.run()
+    return 0 if all_started else 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+
+class ImageFolder:
+    """
+    The PNG files within a directory tree. They are discovered while iterating, so the evaluation starts
+    before the walk is finished. Optionally, the files found are stored in a manifest read by later runs instead
+    of walking the tree again.
+    """
+
+    SUFFIX = ".png"
+
+    def __init__(
+        self,
+        root: Path,
+        manifest: Optional[Path] = None,
+        workers: int = 1,
+        rescan: bool = False,
+    ):
+        self.root = root
+        self.manifest = manifest
+        self.workers = max(workers, 1)
+        self._rescan = rescan
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[Path]:
+        with self._lock:
+            use_manifest = (
+                self.manifest is not None
+                and not self._rescan
+                and self.manifest.is_file()
+            )
+
+        if use_manifest:
+            yield from self._read_manifest()
+        elif self.manifest is None:
+            yield from self._walk()
+        else:
+            yield from self._walk_and_record()
+
+    def _read_manifest(self) -> Iterator[Path]:
+        with self.manifest.open("r", encoding="utf-8") as file:
+            for line in file:
+                line = line.rstrip("\n")
+                if line:
+                    yield self.root / line
+
+    def _walk_and_record(self) -> Iterator[Path]:
+        # Concurrent walks write distinct files, the manifest is only replaced once a walk is complete
+        temporary = self.manifest.with_name(
+            f"{self.manifest.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            with temporary.open("w", encoding="utf-8") as file:
+                for path in self._walk():
+                    file.write(path.relative_to(self.root).as_posix() + "\n")
+                    yield path
+            os.replace(temporary, self.manifest)
+            with self._lock:
+                self._rescan = False
+        finally:
+            if temporary.exists():
+                temporary.unlink()
+
+    def _walk(self) -> Iterator[Path]:
+        """
+        Walk the tree depth-first with entries sorted by name. With multiple workers, the directories
+        are listed ahead concurrently, which hides the latency of network file systems.
+        """
+        if self.workers == 1:
+            pending = [self.root]
+            while len(pending) > 0:
+                files, directories = _scan(pending.pop())
+                yield from files
+                pending.extend(reversed(directories))
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = [executor.submit(_scan, self.root)]
+            while len(pending) > 0:
+                files, directories = pending.pop().result()
+                pending.extend(
+                    executor.submit(_scan, directory)
+                    for directory in reversed(directories)
+                )
+                yield from files
+
+
+def _scan(directory: Path) -> Tuple[List[Path], List[Path]]:
+    files, directories = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                directories.append(Path(entry.path))
+            elif entry.name.endswith(ImageFolder.SUFFIX) and entry.is_file():
+                files.append(Path(entry.path))
+    files.sort()
+    directories.sort()
+    return files, directories
@@ -1,15 +1,20 @@
 import json
+import shutil
 import socket
 import string
 import subprocess
 import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import closing
-from dataclasses import dataclass
-from http.client import RemoteDisconnected
+from dataclasses import dataclass, field
+from http.client import HTTPConnection, HTTPException, RemoteDisconnected
 from pathlib import Path
-from typing import Any, Optional, Union
-from urllib.error import HTTPError, URLError
-from urllib.request import Request, urlopen
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from .encoding import decode_prediction
 
 
 class InvalidContainerException(Exception):
@@ -26,7 +31,15 @@ class Response:
     """
 
     status: int
-    body: str
+    data: bytes
+    headers: Mapping[str, str] = field(default_factory=dict)
+
+    @property
+    def body(self) -> str:
+        """
+        Decode the body as text.
+        """
+        return self.data.decode("utf-8")
 
     @property
     def json(self) -> Any:
@@ -35,30 +48,92 @@ class Response:
         """
         return json.loads(self.body)
 
+    @property
+    def prediction(self) -> Dict[str, Any]:
+        """
+        Decode the prediction independently of the encoding chosen by the detector.
+        """
+        return decode_prediction(self.data, self.headers.get("Content-Type"))
+
+    @property
+    def server_timing(self) -> Dict[str, float]:
+        """
+        Parse the durations in milliseconds reported by the detector in the "Server-Timing" header, if any.
+        """
+        timings = {}
+        for entry in self.headers.get("Server-Timing", "").split(","):
+            name, *parameters = [part.strip() for part in entry.split(";")]
+            for parameter in parameters:
+                if name and parameter.startswith("dur="):
+                    timings[name] = float(parameter[4:])
+        return timings
+
 
 class Container:
     """
     A container with included pupil detector.
     """
 
-    def __init__(self, name_and_tag: str, show_output: bool = False, remove_container: bool = True):
+    # The seconds a single request may take
+    TIMEOUT = 600
+    MAX_REDIRECTS = 5
+
+    # The seconds the detector may take to start and the bounds of the delay between probing it
+    START_TIMEOUT = 600
+    PROBE_DELAY = (0.05, 1.0)
+
+    def __init__(
+        self,
+        name_and_tag: str,
+        show_output: bool = False,
+        remove_container: bool = True,
+        in_flight: int = 1,
+    ):
         self.name_and_tag = name_and_tag
+        self.in_flight = in_flight
         self.port = Container._find_free_port()
         self.entry_point = f"http://127.0.0.1:{self.port}"
         self.remove_container = remove_container
         self._process = None
         self._is_ready = False
+        self._container_id: Optional[str] = None
+        self._cid_dir: Optional[str] = None
+        self._attached = False
+        self._lock = threading.Lock()
+        self._connections: List[HTTPConnection] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
         self._output = (
             subprocess.DEVNULL
             if not show_output
             else tempfile.TemporaryFile(mode="w+t")
         )
 
+    @staticmethod
+    def attach(
+        name_and_tag: str, container_id: str, port: int, in_flight: int = 1
+    ) -> "Container":
+        """
+        Use a container running independently, which is neither started nor stopped.
+        """
+        container = Container(name_and_tag, in_flight=in_flight)
+        container.port = port
+        container.entry_point = f"http://127.0.0.1:{port}"
+        container._container_id = container_id
+        container._attached = True
+        return container
+
     def __enter__(self) -> "Container":
+        if self._attached:
+            return self
+
+        # Docker writes the ID of the container to the file, which must not exist yet
+        self._cid_dir = tempfile.mkdtemp(prefix="ommatidia-")
         self._process = subprocess.Popen(
             (
                 "docker",
                 "run",
+                "--cidfile",
+                str(Path(self._cid_dir) / "cid"),
                 "-p",
                 f"127.0.0.1:{self.port}:8080/tcp",
                 self.name_and_tag,
@@ -69,6 +144,8 @@ class Container:
         return self
 
     def __exit__(self, _type, _value, _tb):
+        self._close_connections()
+
         # Close the buffer if requested
         if not isinstance(self._output, int):
             self._output.close()
@@ -78,72 +155,161 @@ class Container:
             Container._kill(self.container_id, remove=self.remove_container)
             self._process.wait(5)
 
-    def is_ready(self, wait: int) -> bool:
+        if self._cid_dir is not None:
+            shutil.rmtree(self._cid_dir, ignore_errors=True)
+            self._cid_dir = None
+
+    def is_ready(self) -> bool:
         """
-        Check for the detector if it is ready. This will yield InvalidDetectorException on errors.
+        Probe the detector once without waiting. This will yield InvalidContainerException on errors.
         """
 
-        if self._process is None:
+        if self._process is None and not self._attached:
             raise ValueError("The process is not started")
         if self._is_ready:
             return True
 
-        # Wait some time to allow start of the process
-        try:
-            self._process.wait(wait)
-            # The detector should not exit by itself!
+        # The detector should not exit by itself!
+        if self._process is not None and self._process.poll() is not None:
             raise InvalidContainerException("Unable to start the detector")
-        except subprocess.TimeoutExpired:
-            pass
 
+        # Detectors reporting their warm-up are ready once it is done, the others once they respond at all
+        status = self._probe("/ready/")
+        if status is not None and status not in (200, 503):
+            status = self._probe("/")
+            if status is not None and status >= 400:
+                raise InvalidContainerException(
+                    f"The HTTP response of the detector appears corrupt: status {status}"
+                )
+        self._is_ready = status is not None and status < 400
+        return self._is_ready
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> None:
+        """
+        Probe the detector with exponentially increasing delays until it is ready. This will yield
+        InvalidContainerException on errors or if it does not get ready in time.
+        """
+
+        deadline = time.monotonic() + (
+            timeout if timeout is not None else Container.START_TIMEOUT
+        )
+        delay, max_delay = Container.PROBE_DELAY
+        while not self.is_ready():
+            if time.monotonic() >= deadline:
+                raise InvalidContainerException(
+                    "The detector did not get ready in time"
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def _probe(self, relative_url: str) -> Optional[int]:
+        # Docker accepts the connection before the detector does, which is reset afterwards
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=max(Container.PROBE_DELAY))
         try:
-            with urlopen(f"{self.entry_point}/"):
-                self._is_ready = True
-                return True
-        except URLError as error:
-            # We are unable to connect
-            if isinstance(error.reason, socket.timeout):
-                return False
-            raise InvalidContainerException(
-                f"The HTTP response of the detector appears corrupt: {error}"
-            ) from error
-        except RemoteDisconnected:
-            return False
-        except ConnectionResetError:
-            return False
-        
+            connection.request("GET", relative_url)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, HTTPException):
+            return None
+        finally:
+            connection.close()
+
     def request(
         self,
         relative_url: str,
         method: str = "GET",
         body: Union[bytes, Any, None] = None,
         content_type: Optional[str] = None,
+        accept: Optional[str] = None,
     ) -> Response:
         """
-        Send a HTTP request to the detector.
+        Send a HTTP request to the detector. The connections are kept alive and reused by subsequent requests.
         """
 
-        if not self._is_ready and not self.is_ready(2):
-            raise ValueError("The container is not ready")
+        if not self._is_ready:
+            self.wait_until_ready()
 
-        request = Request(url=f"{self.entry_point}{relative_url}", method=method)
+        headers = {}
         if body is not None:
             # Check if it is already serialized
-            if isinstance(body, bytes):
-                request.data = body
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = (
+                "application/json" if content_type is None else content_type
+            )
+        if accept is not None:
+            headers["Accept"] = accept
+
+        for _ in range(Container.MAX_REDIRECTS):
+            response = self._send(method, relative_url, body, headers)
+
+            # Follow redirects as urllib did, i.e. for missing trailing slashes
+            location = response.headers.get("Location")
+            if (
+                response.status not in (301, 302, 303, 307, 308)
+                or location is None
+                or method not in ("GET", "HEAD")
+            ):
+                return response
+            relative_url = urlunsplit(("", "") + urlsplit(location)[2:])
+        return response
+
+    def submit(self, *args, **kwargs) -> "Future[Response]":
+        """
+        Send a HTTP request without waiting for its response. Up to "in_flight" requests are processed
+        concurrently, each using a connection of its own. The arguments are the same as for "request".
+        """
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.in_flight)
+        return self._executor.submit(self.request, *args, **kwargs)
+
+    def _send(
+        self, method: str, relative_url: str, body: Optional[bytes], headers: Dict[str, str]
+    ) -> Response:
+        # A kept-alive connection may have been closed by the server in the meantime. Retry once on a new one.
+        for attempt in range(2):
+            connection, reused = self._acquire_connection()
+            try:
+                connection.request(method, relative_url, body=body, headers=headers)
+                response = connection.getresponse()
+                result = Response(response.status, response.read(), response.headers)
+            except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if not reused or attempt > 0:
+                    raise
+                continue
+            except BaseException:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
             else:
-                request.data = json.dumps(body).encode("utf-8")
+                self._release_connection(connection)
+            return result
 
-            request.add_header(
-                "Content-Type",
-                "application/json" if content_type is None else content_type,
-            )
+    def _acquire_connection(self) -> Tuple[HTTPConnection, bool]:
+        with self._lock:
+            if len(self._connections) > 0:
+                return self._connections.pop(), True
+        return HTTPConnection("127.0.0.1", self.port, timeout=Container.TIMEOUT), False
 
-        try:
-            with urlopen(request) as response:
-                return Response(200, response.read().decode("utf-8"))
-        except HTTPError as error:
-            return Response(error.code, error.read().decode("utf-8"))
+    def _release_connection(self, connection: HTTPConnection) -> None:
+        with self._lock:
+            self._connections.append(connection)
+
+    def _close_connections(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
 
     @property
     def output(self) -> Optional[str]:
@@ -161,8 +327,17 @@ class Container:
     @property
     def container_id(self) -> str:
         """
-        Query the ID of the container. This operation is rather expensive, consider catching it.
+        Query the ID of the container. It is written to a file by Docker once the container is created.
         """
+        if self._container_id is None:
+            cid_file = Path(self._cid_dir) / "cid" if self._cid_dir is not None else None
+            if cid_file is not None and cid_file.is_file():
+                self._container_id = cid_file.read_text().strip() or None
+            if self._container_id is None:
+                self._container_id = self._query_container_id()
+        return self._container_id
+
+    def _query_container_id(self) -> str:
         with subprocess.Popen(
             (
                 "docker",
@@ -275,6 +450,25 @@ class Image:
         """
         return Container(self.name_and_tag, show_output=show_output)
 
+    @staticmethod
+    def digest(name_and_tag: str) -> str:
+        """
+        Query the content-addressable ID of a local image.
+        """
+        try:
+            result = subprocess.run(
+                ("docker", "image", "inspect", "--format", "{{.Id}}", name_and_tag),
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=30,
+            )
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as ex:
+            raise InvalidContainerException(
+                f"Unable to query the ID of the image '{name_and_tag}'"
+            ) from ex
+        return result.stdout.decode("ascii", errors="ignore").strip()
+
     @staticmethod
     def _create_name_and_tag(path: Path) -> str:
         valid_chars = string.ascii_uppercase + string.ascii_lowercase
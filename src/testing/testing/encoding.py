@@ -0,0 +1,27 @@
+import json
+import math
+import struct
+from typing import Any, Dict, Optional
+
+# Mirrors the compact binary layout of the predictions offered by the Python detectors
+MEDIA_TYPE_BINARY = "application/x-ommatidia-prediction"
+PREDICTION = struct.Struct("<6d2I")
+
+
+def decode_prediction(data: bytes, content_type: Optional[str]) -> Dict[str, Any]:
+    """
+    Decode a prediction independently of its encoding into the structure of its JSON representation.
+    """
+    if content_type is None or not content_type.startswith(MEDIA_TYPE_BINARY):
+        return json.loads(data.decode("utf-8"))
+
+    x, y, major, minor, rotation, confidence, width, height = PREDICTION.unpack(data)
+    prediction = {
+        "x": x,
+        "y": y,
+        "confidence": None if math.isnan(confidence) else confidence,
+        "sample": {"width": width, "height": height},
+    }
+    if not math.isnan(major):
+        prediction.update(major=major, minor=minor, rotation=rotation)
+    return prediction
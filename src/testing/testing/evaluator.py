@@ -0,0 +1,125 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterable, Mapping, Optional, Sequence
+
+from .docker import Container, Response
+from .encoding import MEDIA_TYPE_BINARY
+from .frames import Frame
+
+# Decides for the index, the path, and the content hash of an image whether it can be skipped
+SkipCallback = Callable[[int, Path, str], bool]
+
+# Receives the index, the path, and the content hash of an image with the response and its duration in milliseconds
+ResultCallback = Callable[[int, Path, str, Response, float], None]
+
+
+class AsyncEvaluator:
+    """
+    Evaluate images on one or more containers of the same detector while overlapping disk I/O, network,
+    and computation. The images are read ahead and each container has up to "window" requests outstanding.
+    The containers share a single queue of images, so faster ones process more of them. The frames may be
+    read lazily, as they are only iterated once the detectors are ready.
+    """
+
+    def __init__(
+        self,
+        containers: Sequence[Container],
+        frames: Iterable[Frame],
+        window: int = 1,
+        prefetch: int = 16,
+        config: Optional[Mapping[str, Any]] = None,
+    ):
+        self.containers = containers
+        self.frames = frames
+        self.window = max(window, 1)
+        self.prefetch = max(prefetch, 1)
+        self.config = config if config is not None else {}
+
+    def run(self, on_result: ResultCallback, skip: Optional[SkipCallback] = None) -> bool:
+        """
+        Evaluate all the images not skipped. The results are reported as soon as they arrive, i.e. in arbitrary
+        order. Returns False if a detector could not be created.
+        """
+        return asyncio.run(self._evaluate(on_result, skip))
+
+    async def _evaluate(self, on_result: ResultCallback, skip: Optional[SkipCallback]) -> bool:
+        detector_paths = await asyncio.gather(
+            *[self._create_detector(container) for container in self.containers]
+        )
+        if any(detector_path is None for detector_path in detector_paths):
+            return False
+
+        queue = asyncio.Queue(maxsize=self.prefetch)
+        consumers = [
+            self._consume(queue, container, detector_path, on_result)
+            for container, detector_path in zip(self.containers, detector_paths)
+            for _ in range(self.window)
+        ]
+        await asyncio.gather(self._produce(queue, len(consumers), skip), *consumers)
+
+        # Containers may be reused, so do not leave the detectors behind
+        await asyncio.gather(
+            *[
+                asyncio.wrap_future(container.submit(detector_path, method="DELETE"))
+                for container, detector_path in zip(self.containers, detector_paths)
+            ]
+        )
+        return True
+
+    async def _create_detector(self, container: Container) -> Optional[str]:
+        response = await asyncio.wrap_future(
+            container.submit("/detections/", method="POST", body=dict(self.config))
+        )
+        if response.status != 200:
+            return None
+        return f"/detections/{response.body}/"
+
+    async def _produce(
+        self, queue: asyncio.Queue, consumers: int, skip: Optional[SkipCallback]
+    ) -> None:
+        # Reading the frames blocks
+        loop = asyncio.get_running_loop()
+        frames = iter(self.frames)
+        index = 0
+        while True:
+            frame = await loop.run_in_executor(None, next, frames, None)
+            if frame is None:
+                break
+
+            image_path, image, image_hash = frame
+            if skip is None or not skip(index, image_path, image_hash):
+                await queue.put((index, image_path, image_hash, image))
+            index += 1
+
+        # Signal the end to every consumer
+        for _ in range(consumers):
+            await queue.put(None)
+
+    async def _consume(
+        self,
+        queue: asyncio.Queue,
+        container: Container,
+        detector_path: str,
+        on_result: ResultCallback,
+    ) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            # Detectors not supporting the compact encoding fall back to JSON
+            index, image_path, image_hash, image = item
+            start = time.perf_counter()
+            response = await asyncio.wrap_future(
+                container.submit(
+                    detector_path,
+                    method="POST",
+                    body=image,
+                    content_type="image/png",
+                    accept=f"{MEDIA_TYPE_BINARY}, application/json",
+                )
+            )
+            on_result(
+                index, image_path, image_hash, response, (time.perf_counter() - start) * 1000.0
+            )
@@ -0,0 +1,160 @@
+import ast
+import csv
+import math
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+# The columns of the results and their representation within structured numpy arrays
+COLUMNS = (
+    ("Detector", "|S64"),
+    ("File", "|S256"),
+    ("X", "<f8"),
+    ("Y", "<f8"),
+    ("Confidence", "<f8"),
+    ("Request [ms]", "<f8"),
+    ("Decode [ms]", "<f8"),
+    ("Infer [ms]", "<f8"),
+    ("Serialize [ms]", "<f8"),
+)
+
+
+class ResultSink:
+    """
+    A destination the results are written to as soon as they arrive. Sinks are shared between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, _type, _value, _tb):
+        self.close()
+
+    def write(self, row: Sequence[Any]) -> None:
+        """
+        Write a single row with values in the order of the columns.
+        """
+        with self._lock:
+            self._write(row)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _write(self, row: Sequence[Any]) -> None:
+        raise NotImplementedError("Not implemented by subclass")
+
+    def _close(self) -> None:
+        raise NotImplementedError("Not implemented by subclass")
+
+
+class TsvSink(ResultSink):
+    """
+    Write the results as tab-separated text.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__()
+        self._file = path.open("w", newline="")
+        self._writer = csv.writer(
+            self._file, delimiter="\t", quotechar='"', quoting=csv.QUOTE_MINIMAL
+        )
+        self._writer.writerow(name for name, _ in COLUMNS)
+
+    def _write(self, row: Sequence[Any]) -> None:
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class NpySink(ResultSink):
+    """
+    Write the results as structured numpy array (".npy" version 1.0) without depending on numpy. The file may be
+    memory-mapped by "numpy.load(path, mmap_mode='r')". Missing values are NaN, texts are encoded as UTF-8.
+    """
+
+    MAGIC = b"\x93NUMPY\x01\x00"
+    RECORD = struct.Struct(
+        "<"
+        + "".join(
+            f"{dtype[2:]}s" if dtype.startswith("|S") else "d" for _, dtype in COLUMNS
+        )
+    )
+
+    def __init__(self, path: Path):
+        super().__init__()
+        self._file = path.open("wb")
+        self._count = 0
+
+        # The number of rows is unknown until the end. Reserve space for the header to rewrite it later on.
+        self._header_size = len(NpySink._header(10**20))
+        self._file.write(NpySink._header(0, self._header_size))
+
+    def _write(self, row: Sequence[Any]) -> None:
+        values = []
+        for value, (_, dtype) in zip(row, COLUMNS):
+            if dtype.startswith("|S"):
+                values.append(str(value).encode("utf-8"))
+            else:
+                values.append(math.nan if value is None else float(value))
+        self._file.write(NpySink.RECORD.pack(*values))
+        self._count += 1
+
+    def _close(self) -> None:
+        self._file.seek(0)
+        self._file.write(NpySink._header(self._count, self._header_size))
+        self._file.close()
+
+    @staticmethod
+    def _header(count: int, size: Optional[int] = None) -> bytes:
+        description = {
+            "descr": list(COLUMNS),
+            "fortran_order": False,
+            "shape": (count,),
+        }
+        header = repr(description).encode("latin1")
+        if ast.literal_eval(header.decode("latin1")) != description:
+            raise ValueError("The columns can not be described within the header")
+
+        # The data must be aligned to 64 bytes and the header terminated by a newline
+        length = len(NpySink.MAGIC) + 2 + len(header) + 1
+        padding = (size - length) if size is not None else (-length % 64)
+        if padding < 0:
+            raise ValueError("The header exceeds the space reserved for it")
+        header += b" " * padding + b"\n"
+        return NpySink.MAGIC + struct.pack("<H", len(header)) + header
+
+
+class OrderedWriter:
+    """
+    Write the rows to a sink in the order of their indices, while they arrive in arbitrary order. Only the rows
+    ahead of the next one in order are held back. Missing rows, i.e. of failed detections, are None.
+    """
+
+    def __init__(self, sink: Optional[ResultSink]):
+        self.sink = sink
+        self._pending: Dict[int, Optional[Sequence[Any]]] = {}
+        self._next_index = 0
+
+    def complete(self, index: int, row: Optional[Sequence[Any]]) -> None:
+        self._pending[index] = row
+        while self._next_index in self._pending:
+            row = self._pending.pop(self._next_index)
+            if row is not None and self.sink is not None:
+                self.sink.write(row)
+            self._next_index += 1
+
+
+def open_sink(path: Path) -> ResultSink:
+    """
+    Open the sink matching the file extension, i.e. ".npy" for numpy arrays and tab-separated text otherwise.
+    """
+    if path.suffix.lower() == ".npy":
+        return NpySink(path)
+    return TsvSink(path)
@@ -0,0 +1,112 @@
+import collections
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+# The path, the content, and the content hash of an image
+Frame = Tuple[Path, bytes, str]
+
+
+def read_frames(files: Iterable[Path]) -> Iterator[Frame]:
+    """
+    Read the images one after another.
+    """
+    for image_path in files:
+        try:
+            image = image_path.read_bytes()
+        except OSError as ex:
+            # The file may be removed after it was discovered
+            logging.warning("Unable to read '%s': %s", image_path, ex)
+            continue
+        yield image_path, image, hashlib.sha256(image).hexdigest()
+
+
+class FrameBroadcast:
+    """
+    Read the frames once and hand each of them to a fixed number of consumers running concurrently. A frame is
+    dropped once all consumers received it, and at most "capacity" frames are held. Consequently, consumers
+    running ahead wait for the slowest one. Each consumer must be closed once it is done, even if it never
+    started consuming, so it does not hold back the others.
+    """
+
+    def __init__(self, frames: Iterable[Frame], consumers: int, capacity: int = 64):
+        self.capacity = max(capacity, 1)
+        self._frames = iter(frames)
+        self._condition = threading.Condition()
+
+        # The buffer starts with the frame at the offset. A position of None marks a closed consumer.
+        self._buffer = collections.deque()
+        self._offset = 0
+        self._positions = [0] * consumers
+        self._reading = False
+        self._exhausted = False
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def subscribe(self, consumer: int) -> Iterator[Frame]:
+        """
+        Iterate over the frames for a consumer.
+        """
+        while True:
+            frame = self._next(consumer)
+            if frame is None:
+                return
+            yield frame
+
+    def close(self, consumer: int) -> None:
+        """
+        Stop handing frames to a consumer.
+        """
+        with self._condition:
+            self._positions[consumer] = None
+            self._trim()
+            self._condition.notify_all()
+
+    def _next(self, consumer: int) -> Optional[Frame]:
+        while True:
+            with self._condition:
+                while True:
+                    position = self._positions[consumer]
+                    if position is None:
+                        return None
+                    if position < self._offset + len(self._buffer):
+                        self._positions[consumer] += 1
+                        frame = self._buffer[position - self._offset]
+                        self._trim()
+                        return frame
+                    if self._exhausted:
+                        return None
+
+                    # Only a single consumer reads ahead, while the others wait for it
+                    if not self._reading and len(self._buffer) < self.capacity:
+                        self._reading = True
+                        break
+                    self._condition.wait()
+
+            try:
+                frame = next(self._frames, None)
+            except BaseException:
+                with self._condition:
+                    self._reading = False
+                    self._exhausted = True
+                    self._condition.notify_all()
+                raise
+
+            with self._condition:
+                self._reading = False
+                if frame is None:
+                    self._exhausted = True
+                else:
+                    self._buffer.append(frame)
+                self._condition.notify_all()
+
+    def _trim(self) -> None:
+        positions = [position for position in self._positions if position is not None]
+        slowest = min(positions) if len(positions) > 0 else self._offset + len(self._buffer)
+        while len(self._buffer) > 0 and self._offset < slowest:
+            self._buffer.popleft()
+            self._offset += 1
+        self._condition.notify_all()
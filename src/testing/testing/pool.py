@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .docker import Container, Image, InvalidContainerException
+
+# The file tracking the pool if not specified otherwise
+DEFAULT_STATE_FILE = Path(
+    os.environ.get("OMMATIDIA_POOL", Path.home() / ".ommatidia" / "pool.json")
+)
+
+
+class ContainerPool:
+    """
+    Detector containers kept running between invocations. They are tracked in a state file together with the
+    image they were started from, so containers of outdated images are not reused.
+    """
+
+    def __init__(self, state_file: Path = DEFAULT_STATE_FILE):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+
+    def up(self, name_and_tag: str, replicas: int = 1) -> List[Dict[str, Any]]:
+        """
+        Ensure the given number of containers of the image is running and ready. Containers of an outdated
+        image are replaced.
+        """
+        digest = Image.digest(name_and_tag)
+        with self._lock:
+            entries = self._load()
+        current = [
+            entry
+            for entry in entries
+            if entry["image"] == name_and_tag and entry["digest"] == digest
+        ]
+        if len(current) != len(self._entries_of(entries, name_and_tag)):
+            logging.info("Replacing the outdated containers of '%s'", name_and_tag)
+            self.down(name_and_tag)
+            current = []
+
+        started = [
+            ContainerPool._start(name_and_tag, digest)
+            for _ in range(max(replicas - len(current), 0))
+        ]
+        with self._lock:
+            self._save(self._load() + started)
+
+        for entry in started:
+            Container.attach(
+                name_and_tag, entry["id"], entry["port"]
+            ).wait_until_ready()
+        return current + started
+
+    def down(self, name_and_tag: Optional[str] = None) -> int:
+        """
+        Stop and remove the containers of an image or all of them. Returns their number.
+        """
+        with self._lock:
+            entries = self._load()
+            stopped = (
+                entries
+                if name_and_tag is None
+                else self._entries_of(entries, name_and_tag)
+            )
+            self._save([entry for entry in entries if entry not in stopped])
+
+        for entry in stopped:
+            try:
+                Container._kill(entry["id"], remove=True)
+            except InvalidContainerException as ex:
+                # The container may have been removed by other means
+                logging.warning("Unable to stop container '%s': %s", entry["id"], ex)
+        return len(stopped)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        List all the containers within the pool.
+        """
+        with self._lock:
+            return self._load()
+
+    def acquire(
+        self, name_and_tag: str, replicas: int, in_flight: int = 1
+    ) -> Optional[List[Container]]:
+        """
+        Access running containers of the current image, if there are enough of them and all are responding.
+        """
+        with self._lock:
+            entries = self._entries_of(self._load(), name_and_tag)
+        if len(entries) == 0:
+            return None
+        if len(entries) < replicas:
+            logging.info(
+                "The pool holds only %d of %d containers for '%s'",
+                len(entries),
+                replicas,
+                name_and_tag,
+            )
+            return None
+        if any(entry["digest"] != Image.digest(name_and_tag) for entry in entries):
+            logging.warning(
+                "The pooled containers of '%s' are outdated; start them again", name_and_tag
+            )
+            return None
+
+        containers = [
+            Container.attach(name_and_tag, entry["id"], entry["port"], in_flight=in_flight)
+            for entry in entries[:replicas]
+        ]
+        if not all(container.is_ready() for container in containers):
+            logging.warning("The pooled containers of '%s' are not responding", name_and_tag)
+            return None
+        return containers
+
+    @staticmethod
+    def _entries_of(entries: List[Dict[str, Any]], name_and_tag: str) -> List[Dict[str, Any]]:
+        return [entry for entry in entries if entry["image"] == name_and_tag]
+
+    @staticmethod
+    def _start(name_and_tag: str, digest: str) -> Dict[str, Any]:
+        port = Container._find_free_port()
+        try:
+            result = subprocess.run(
+                (
+                    "docker",
+                    "run",
+                    "-d",
+                    "--label",
+                    "ommatidia.pool=1",
+                    "-p",
+                    f"127.0.0.1:{port}:8080/tcp",
+                    name_and_tag,
+                ),
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=60,
+            )
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as ex:
+            raise InvalidContainerException(
+                f"Unable to start a container of '{name_and_tag}'"
+            ) from ex
+
+        container_id = result.stdout.decode("ascii", errors="ignore").strip()
+        return {"image": name_and_tag, "digest": digest, "id": container_id, "port": port}
+
+    def _load(self) -> List[Dict[str, Any]]:
+        if not self.state_file.is_file():
+            return []
+        with self.state_file.open("r", encoding="utf-8") as file:
+            return json.load(file)["containers"]
+
+    def _save(self, entries: List[Dict[str, Any]]) -> None:
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.state_file.with_name(self.state_file.name + ".tmp")
+        with temporary.open("w", encoding="utf-8") as file:
+            json.dump({"containers": entries}, file, indent=2)
+        os.replace(temporary, self.state_file)
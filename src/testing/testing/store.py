@@ -0,0 +1,73 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+Key = Tuple[str, str, str]
+
+
+def hash_config(config: Mapping[str, Any]) -> str:
+    """
+    Hash the configuration of a detector independently of the order of its keys.
+    """
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+class ResultStore:
+    """
+    An append-only file of results keyed by the hashes of the image content, the detector image, and its
+    configuration. Each result is flushed once it arrives, so an interrupted evaluation may be resumed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._results: Dict[Key, List[Any]] = {}
+
+        if path.is_file():
+            with path.open("r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        key = (entry["image"], entry["detector"], entry["config"])
+                        self._results[key] = entry["result"]
+                    except (ValueError, KeyError, TypeError):
+                        # The last line may be incomplete if the evaluation was interrupted
+                        continue
+
+        self._file = path.open("a", encoding="utf-8")
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, _type, _value, _tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, key: Key) -> Optional[List[Any]]:
+        """
+        Query a result evaluated before.
+        """
+        with self._lock:
+            return self._results.get(key)
+
+    def add(self, key: Key, result: List[Any]) -> None:
+        """
+        Store a result and flush it to the disk.
+        """
+        line = json.dumps(
+            {"image": key[0], "detector": key[1], "config": key[2], "result": result}
+        )
+        with self._lock:
+            self._results[key] = result
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
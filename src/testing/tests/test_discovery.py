@@ -0,0 +1,66 @@
+from testing.discovery import ImageFolder
+
+FILES = ["a.png", "b/c.png", "b/d/e.png", "b/f.png", "g/h.png", "i.png"]
+
+
+def _create(root, names):
+    for name in names:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+
+
+def _names(root, paths):
+    return [path.relative_to(root).as_posix() for path in paths]
+
+
+def test_image_folder_walk(tmp_path):
+    """
+    The PNG files are found depth-first in the order of their names, independently of the number of workers.
+    """
+
+    root = tmp_path / "images"
+    _create(root, FILES + ["b/notes.txt", "j.PNG.bak"])
+    (root / "empty").mkdir()
+
+    assert _names(root, ImageFolder(root)) == ["a.png", "i.png", "b/c.png", "b/f.png", "b/d/e.png", "g/h.png"]
+    assert _names(root, ImageFolder(root, workers=4)) == _names(root, ImageFolder(root))
+
+
+def test_image_folder_manifest(tmp_path):
+    """
+    The files found are recorded in the manifest, which replaces the walk until a rescan is requested.
+    """
+
+    root = tmp_path / "images"
+    manifest = tmp_path / "images.txt"
+    _create(root, FILES)
+
+    found = _names(root, ImageFolder(root, manifest=manifest))
+    assert sorted(found) == sorted(FILES)
+    assert manifest.read_text(encoding="utf-8").splitlines() == found
+
+    # Files added later are not discovered from the manifest
+    _create(root, ["k.png"])
+    assert _names(root, ImageFolder(root, manifest=manifest)) == found
+
+    rescanned = _names(root, ImageFolder(root, manifest=manifest, rescan=True))
+    assert "k.png" in rescanned
+    assert manifest.read_text(encoding="utf-8").splitlines() == rescanned
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_image_folder_interrupted_walk(tmp_path):
+    """
+    The manifest is only written once the walk is complete.
+    """
+
+    root = tmp_path / "images"
+    manifest = tmp_path / "images.txt"
+    _create(root, FILES)
+
+    walk = iter(ImageFolder(root, manifest=manifest))
+    next(walk)
+    walk.close()
+    assert not manifest.exists()
+    assert list(tmp_path.glob("*.tmp")) == []
@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from testing.docker import Response
+from testing.evaluator import AsyncEvaluator
+
+
+class _Container:
+    """
+    Answers the requests of the evaluator like a detector, while recording them.
+    """
+
+    def __init__(self, creation_status: int = 200, window: int = 1):
+        self.creation_status = creation_status
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=window)
+
+    def submit(self, relative_url: str, method: str = "GET", body=None, **_kwargs) -> "Future[Response]":
+        with self._lock:
+            self.requests.append((method, relative_url, body))
+        return self._executor.submit(self._respond, method, body)
+
+    def _respond(self, method: str, body) -> Response:
+        if method != "POST" or isinstance(body, dict):
+            return Response(self.creation_status if method == "POST" else 200, b"7")
+
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # Later images are answered faster, so the results arrive out of order
+        time.sleep(0.01 / (1 + body[0]))
+        with self._lock:
+            self.in_flight -= 1
+        return Response(200, json.dumps({"x": body[0], "y": 0}).encode("utf-8"))
+
+
+def _frames(count: int):
+    return [(Path(f"{i}.png"), bytes([i]), str(i)) for i in range(count)]
+
+
+def test_evaluate_all_frames():
+    """
+    Every image not skipped is evaluated exactly once on any of the containers.
+    """
+
+    containers = [_Container(window=2), _Container(window=2)]
+    evaluator = AsyncEvaluator(containers, _frames(10), window=2, prefetch=2)
+
+    results = {}
+    lock = threading.Lock()
+
+    def on_result(index, image_path, image_hash, response, duration):
+        with lock:
+            assert index not in results
+            results[index] = (image_path, image_hash, response.prediction["x"])
+        assert duration >= 0.0
+
+    assert evaluator.run(on_result, skip=lambda index, _path, _hash: index % 3 == 0)
+
+    assert sorted(results) == [1, 2, 4, 5, 7, 8]
+    assert all(results[i] == (Path(f"{i}.png"), str(i), i) for i in results)
+    assert all(container.max_in_flight <= 2 for container in containers)
+
+    # The detectors are deleted afterwards
+    for container in containers:
+        assert container.requests[0][:2] == ("POST", "/detections/")
+        assert container.requests[-1][:2] == ("DELETE", "/detections/7/")
+
+
+def test_evaluate_creation_failure():
+    """
+    Nothing is evaluated if a detector could not be created.
+    """
+
+    containers = [_Container(), _Container(creation_status=500)]
+    results = []
+    assert not AsyncEvaluator(containers, _frames(3)).run(lambda *args: results.append(args))
+    assert results == []
@@ -0,0 +1,91 @@
+import csv
+import math
+
+import pytest
+
+from testing.export import COLUMNS, NpySink, OrderedWriter, TsvSink, open_sink
+
+ROWS = [
+    ("detector:1", "a.png", 1.5, 2.5, None, 10.0, 1.0, 8.0, 0.5),
+    ("detector:1", "b.png", 3.0, 4.0, 0.75, 12.0, None, None, None),
+]
+
+
+class _ListSink:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+
+def test_ordered_writer():
+    """
+    Rows arriving out of order are written in order, missing ones are left out.
+    """
+
+    sink = _ListSink()
+    writer = OrderedWriter(sink)
+    writer.complete(2, ("c",))
+    writer.complete(1, None)
+    assert sink.rows == []
+
+    writer.complete(0, ("a",))
+    assert sink.rows == [("a",), ("c",)]
+
+    writer.complete(4, ("e",))
+    writer.complete(3, ("d",))
+    assert sink.rows == [("a",), ("c",), ("d",), ("e",)]
+
+
+def test_npy_sink(tmp_path):
+    """
+    The results are readable by numpy, including memory mapping.
+    """
+
+    # The command line interface itself does not depend on numpy
+    np = pytest.importorskip("numpy")
+
+    path = tmp_path / "results.npy"
+    with open_sink(path) as sink:
+        assert isinstance(sink, NpySink)
+        for row in ROWS:
+            sink.write(row)
+
+    results = np.load(path, mmap_mode="r")
+    assert results.dtype.names == tuple(name for name, _ in COLUMNS)
+    assert results.shape == (2,)
+    assert [result.decode("utf-8") for result in results["File"]] == ["a.png", "b.png"]
+    assert results["X"].tolist() == [1.5, 3.0]
+    assert math.isnan(results["Confidence"][0]) and results["Confidence"][1] == 0.75
+    assert np.isnan(results["Decode [ms]"][1])
+
+
+def test_npy_sink_empty(tmp_path):
+    """
+    A file without results is a valid empty array.
+    """
+
+    np = pytest.importorskip("numpy")
+
+    path = tmp_path / "results.npy"
+    open_sink(path).close()
+    assert np.load(path).shape == (0,)
+
+
+def test_tsv_sink(tmp_path):
+    """
+    The results are written as tab-separated text with a header.
+    """
+
+    path = tmp_path / "results.tsv"
+    with open_sink(path) as sink:
+        assert isinstance(sink, TsvSink)
+        for row in ROWS:
+            sink.write(row)
+
+    with path.open("r", newline="") as file:
+        lines = list(csv.reader(file, delimiter="\t"))
+    assert lines[0] == [name for name, _ in COLUMNS]
+    assert lines[1] == ["detector:1", "a.png", "1.5", "2.5", "", "10.0", "1.0", "8.0", "0.5"]
+    assert len(lines) == 3
@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from testing.frames import FrameBroadcast, read_frames
+
+
+def _frames(count: int, read=None):
+    for i in range(count):
+        if read is not None:
+            read.append(i)
+        yield Path(f"{i}.png"), bytes([i]), str(i)
+
+
+def test_read_frames(tmp_path):
+    """
+    The images are read with their content hash, while missing ones are skipped.
+    """
+
+    (tmp_path / "a.png").write_bytes(b"a")
+    frames = list(read_frames([tmp_path / "a.png", tmp_path / "missing.png"]))
+    assert len(frames) == 1
+    assert frames[0][:2] == (tmp_path / "a.png", b"a")
+    assert len(frames[0][2]) == 64
+
+
+def test_frame_broadcast():
+    """
+    Every consumer receives all the frames in order, while each frame is read only once.
+    """
+
+    read = []
+    broadcast = FrameBroadcast(_frames(20, read), 3, capacity=2)
+
+    def consume(consumer: int):
+        try:
+            return [frame[2] for frame in broadcast.subscribe(consumer)]
+        finally:
+            broadcast.close(consumer)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(consume, range(3)))
+
+    assert results == [[str(i) for i in range(20)]] * 3
+    assert read == list(range(20))
+
+
+def test_frame_broadcast_capacity():
+    """
+    Consumers running ahead wait for the slowest one, unless it is closed.
+    """
+
+    broadcast = FrameBroadcast(_frames(10), 2, capacity=3)
+    fast = broadcast.subscribe(0)
+    assert [next(fast)[2] for _ in range(3)] == ["0", "1", "2"]
+
+    # The buffer is full until the slow consumer proceeds
+    received = []
+    thread = threading.Thread(target=lambda: received.append(next(fast)[2]))
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive() and received == []
+
+    broadcast.close(1)
+    thread.join(1.0)
+    assert received == ["3"]
+    assert [frame[2] for frame in fast] == [str(i) for i in range(4, 10)]
@@ -0,0 +1,33 @@
+from testing.store import ResultStore, hash_config
+
+
+def test_hash_config():
+    """
+    The hash depends on the values of the configuration, but not on the order of its keys.
+    """
+
+    assert hash_config({"a": 1, "b": [2, 3]}) == hash_config({"b": [2, 3], "a": 1})
+    assert hash_config({"a": 1}) != hash_config({"a": 2})
+    assert hash_config({}) != hash_config({"a": None})
+
+
+def test_store_round_trip(tmp_path):
+    """
+    Results are available in later runs, while an incomplete last line is ignored.
+    """
+
+    path = tmp_path / "results.jsonl"
+    key = ("image", "detector", hash_config({}))
+    with ResultStore(path) as store:
+        assert store.get(key) is None
+        store.add(key, ["detector:1", "a.png", 1.5, 2.5, None])
+        store.add(("other", "detector", hash_config({})), ["detector:1", "b.png", 3.0, 4.0, 0.5])
+
+    # The evaluation was interrupted while writing a result
+    with path.open("a", encoding="utf-8") as file:
+        file.write('{"image": "trunc')
+
+    with ResultStore(path) as store:
+        assert len(store) == 2
+        assert store.get(key) == ["detector:1", "a.png", 1.5, 2.5, None]
+        assert store.get(("image", "detector", hash_config({"a": 1}))) is None